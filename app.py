@@ -1,15 +1,23 @@
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import matplotlib.font_manager as fm
-import matplotlib.ticker as ticker
-import matplotlib.dates as mdates
-from supabase import create_client
 from datetime import datetime, timedelta
-import re
+import time
+import threading
+import uuid
 import os
-import requests
 import numpy as np
+from local_cache import PartitionedCache, day_bounds
+from catalog import Catalog
+from rollup import RollupStore, pick_level
+from fetch_engine import ShardedFetcher
+from downsample import downsample, point_budget
+from rainfall import interval_totals
+from shared_store import SharedSeriesStore
+from render import ImageCache, Renderer, array_version, content_key
+from cleaning import CleaningEngine, clean_batch
+from instrument import Recorder, activate, deactivate, span
+from fonts import find_cjk_font
+# 绘图 (matplotlib) 只在渲染进程里导入；数据库客户端 (supabase)、Excel 解析与上传在第一次用到时才导入
 
 # ================= 1. 配置区域 =================
 SUPABASE_URL = "https://vetupomjinhylqpxnrhn.supabase.co"
@@ -18,416 +26,661 @@ SUPABASE_KEY = "sb_publishable_MpHqZeFn_U-lM19lpEBtMA_NR3Mx3mO"
 TABLE_SENSORS = "sensor_measurements"
 TABLE_RAIN = "weather_logs"
 
-REGEX_PATTERN = re.compile(r"^([a-zA-Z0-9]+)(?:号)?([\u4e00-\u9fa5]+)\s+([\u4e00-\u9fa5]+)(?:[\(（](.+)[\)）])?(?:\.\d+)?$")
+# 本地列式缓存目录 (按天分区的 Parquet)，刷新时只增量拉取
+CACHE_DIR = os.environ.get("SCIPLOT_CACHE_DIR", ".sciplot_cache")
+
+# 并发分片拉取：每页行数 / 同时在途的请求数
+FETCH_PAGE_SIZE = 20000
+FETCH_CONCURRENCY = int(os.environ.get("SCIPLOT_FETCH_CONCURRENCY", "4"))
+# 同时在途的 upsert 请求数
+UPLOAD_CONCURRENCY = int(os.environ.get("SCIPLOT_UPLOAD_CONCURRENCY", "4"))
+# 进程级共享序列存储的内存预算 (MB)，超出后淘汰无会话引用的数据
+MEMORY_BUDGET_MB = int(os.environ.get("SCIPLOT_MEMORY_BUDGET_MB", "1024"))
+# 可用性目录的后台增量更新间隔 (秒)：间隔内再次加载不再扫描数据库
+CATALOG_MAX_AGE = int(os.environ.get("SCIPLOT_CATALOG_MAX_AGE", "300"))
+# 目录尚未建立时，列出序列用的探测行数 (区间首尾各取这么多行)
+SERIES_PROBE_ROWS = 5000
+
+# 画布尺寸与分辨率，决定每条曲线的降采样点数
+FIG_SIZE = (10, 6)
+FIG_DPI = 100
+DOWNSAMPLE_MODES = {"最值保留 (min/max)": "minmax", "LTTB 形状保留": "lttb"}
+# 绘图进程数 (0 表示在当前线程绘图) 与图片缓存上限 (MB)
+RENDER_WORKERS = int(os.environ.get("SCIPLOT_RENDER_WORKERS", str(os.cpu_count() or 1)))
+IMAGE_CACHE_MB = int(os.environ.get("SCIPLOT_IMAGE_CACHE_MB", "128"))
+# 清洗结果缓存上限 (MB)
+CLEANING_CACHE_MB = int(os.environ.get("SCIPLOT_CLEANING_CACHE_MB", "256"))
 
 # --- 🎨 科研级配色盘 (Nature/Science 风格) ---
 SCI_COLORS = ['#E64B35', '#4DBBD5', '#00A087', '#3C5488', '#F39B7F', '#8491B4', '#91D1C2', '#DC0000']
 
 # ================= 2. 核心功能函数 =================
+def is_configured():
+    return "你的_SUPABASE" not in SUPABASE_URL
+
 @st.cache_resource
 def init_connection():
-    if "你的_SUPABASE" in SUPABASE_URL:
-        st.error("❌ 错误：请在代码第 15-16 行填入你自己的 Supabase URL 和 Key！")
-        return None
+    # 第一次真正访问数据库时才导入 supabase 并创建客户端，首屏不等它
+    from supabase import create_client
     try:
         return create_client(SUPABASE_URL, SUPABASE_KEY)
     except Exception as e:
         st.error(f"❌ 数据库连接失败: {e}")
         return None
 
-supabase = init_connection()
+def get_client():
+    """数据库客户端 (首次调用时创建)；未配置或连接失败时为 None"""
+    return init_connection() if is_configured() else None
 
 @st.cache_resource
-def get_chinese_font():
-    font_name = "SimHei.ttf"
-    if not os.path.exists(font_name):
-        try:
-            url = "https://github.com/StellarCN/scp_zh/raw/master/fonts/SimHei.ttf"
-            response = requests.get(url, timeout=5)
-            with open(font_name, "wb") as f:
-                f.write(response.content)
-        except: pass
-    try:
-        return fm.FontProperties(fname=font_name)
-    except: return None
+def get_font_path():
+    # 只在本地找中文字体：仓库目录里的 SimHei.ttf，或 matplotlib 字体缓存中的中文字体，不访问网络
+    return find_cjk_font([os.path.join(os.path.dirname(os.path.abspath(__file__)), "SimHei.ttf")])
 
-zh_font = get_chinese_font()
+@st.cache_resource
+def init_local_cache():
+    # 进程级单例，所有会话共用同一份磁盘缓存
+    return {
+        TABLE_SENSORS: PartitionedCache(CACHE_DIR, TABLE_SENSORS, key_cols=['sensor_id', 'variable_type']),
+        TABLE_RAIN: PartitionedCache(CACHE_DIR, TABLE_RAIN),
+    }
 
-# ================= 3. 数据智能处理 =================
+local_cache = init_local_cache()
 
-def optimize_dataframe(df, time_col='timestamp'):
-    """智能降采样：防止数据量过大导致截断或卡顿"""
-    MAX_POINTS_PER_SERIES = 5000
-    if df.empty: return df
-    total_rows = len(df)
-    if total_rows < MAX_POINTS_PER_SERIES: return df
+@st.cache_resource
+def init_rollups():
+    # 汇总金字塔挂在缓存上，缓存写入 / 失效时自动增量维护
+    return {
+        TABLE_SENSORS: RollupStore(local_cache[TABLE_SENSORS], value_stat='mean', dim_cols=['unit']),
+        TABLE_RAIN: RollupStore(local_cache[TABLE_RAIN], value_stat='sum'),
+    }
 
-    min_t = df[time_col].min()
-    max_t = df[time_col].max()
-    time_span = max_t - min_t
-    
-    if time_span.days > 365: rule = '1H'
-    else: return df
-    
-    #st.toast(f"💡 数据量较大 ({total_rows}行)，已优化显示粒度: {rule}", icon="⚡")
-    df = df.set_index(time_col)
-    # 按传感器ID和类型分组降采样
-    resampled = df.groupby(['sensor_id', 'variable_type', 'unit'])['value'].resample(rule).mean().reset_index()
-    return resampled
+local_rollups = init_rollups()
+
+@st.cache_resource
+def init_catalogs():
+    # 可用性目录同样挂在缓存上：某天完整写入缓存时顺带校正该天的计数
+    catalogs = {
+        TABLE_SENSORS: Catalog(CACHE_DIR, TABLE_SENSORS, key_cols=['sensor_id', 'variable_type'], dim_cols=['unit']),
+        TABLE_RAIN: Catalog(CACHE_DIR, TABLE_RAIN),
+    }
+    for table, catalog in catalogs.items():
+        local_cache[table].subscribe(catalog.on_cache_change(local_cache[table]))
+    return catalogs
+
+catalogs = init_catalogs()
+
+@st.cache_resource
+def init_catalog_refresher():
+    # 进程级：同一时刻最多一个后台目录更新线程，上次的错误留给下次加载显示
+    return {"lock": threading.Lock(), "thread": None, "error": None}
+
+catalog_refresher = init_catalog_refresher()
+
+@st.cache_resource
+def init_shared_store():
+    # 所有会话共用的只读序列数据，会话里只保存句柄
+    return SharedSeriesStore(MEMORY_BUDGET_MB * 1024 * 1024)
+
+shared_store = init_shared_store()
+
+@st.cache_resource
+def init_renderer():
+    # 绘图进程池和图片缓存同样是进程级的，输入相同的图在各会话间复用
+    return Renderer(ImageCache(IMAGE_CACHE_MB * 1024 * 1024), max_workers=RENDER_WORKERS)
+
+renderer = init_renderer()
+image_cache = renderer.cache
+
+@st.cache_resource
+def init_cleaning():
+    # 清洗结果按序列版本记忆，只改版面布局时不必重新去尖峰
+    return CleaningEngine(CLEANING_CACHE_MB * 1024 * 1024)
+
+cleaning = init_cleaning()
+
+def invalidate_cache(start_time, end_time, table=TABLE_SENSORS):
+    """回填历史数据后，让对应日期的缓存分区失效"""
+    local_cache[table].invalidate(start_time, end_time)
+    if table == TABLE_SENSORS:
+        shared_store.invalidate(start_time, end_time)
+
+# ================= 3. 数据智能处理 =================
 
 # ================= 替换原有的 get_sensor_data =================
-def get_sensor_data(start_time, end_time):
-    if not supabase: return pd.DataFrame()
-    
-    all_chunks = []
-    current_cursor = start_time
-    
-    # 限制最大读取次数，防止死循环 (假设每次2万条，50次就是100万条，足够了)
-    MAX_LOOPS = 50
-    BATCH_SIZE = 20000 
-    
+def _fetch_with_progress(fetcher, start_time, end_time, filters=None, label="数据"):
+    # 返回 (DataFrame, 实际读取的分片)：按目录跳过的时段不算已同步，缓存清单只登记读过的分片
     # 进度提示
     status_text = st.sidebar.empty()
     progress_bar = st.sidebar.progress(0)
     
+    def on_progress(total_loaded, done, total):
+        status_text.text(f"📥 已加载 {total_loaded} 条{label} ({done}/{total} 分片)...")
+        progress_bar.progress(done / total)
+    
     try:
-        for i in range(MAX_LOOPS):
-            # 1. 每次只查 BATCH_SIZE 条，速度快，不超时
-            response = supabase.table(TABLE_SENSORS) \
-                .select("timestamp, sensor_id, variable_type, value, unit") \
-                .gt("timestamp", current_cursor.isoformat()) \
-                .lte("timestamp", end_time.isoformat()) \
-                .limit(BATCH_SIZE) \
-                .order("timestamp").execute()
-            
-            data = response.data
-            
-            if not data:
-                break # 没数据了，停止
-                
-            # 转为 DataFrame
-            chunk_df = pd.DataFrame(data)
-            all_chunks.append(chunk_df)
-            
-            # 更新进度
-            count = len(chunk_df)
-            total_loaded = sum([len(df) for df in all_chunks])
-            status_text.text(f"📥 已加载 {total_loaded} 条数据...")
-            progress_bar.progress(min((i + 1) / MAX_LOOPS, 1.0))
-            
-            # 2. 更新游标：将最后一条数据的时间作为下一次查询的起点
-            last_time_str = data[-1]['timestamp']
-            # 简单解析时间字符串，防止时区问题
-            current_cursor = pd.to_datetime(last_time_str).replace(tzinfo=None)
-            
-            # 如果这一次没取满，说明已经是最后一批了
-            if count < BATCH_SIZE:
-                break
-        
+        shards = fetcher.plan(start_time, end_time, filters)
+        return fetcher.fetch(start_time, end_time, filters=filters, progress=on_progress, shards=shards), shards
+    finally:
         # 清除进度条
         status_text.empty()
         progress_bar.empty()
-        
-        # 3. 合并所有碎片
-        if not all_chunks:
-            return pd.DataFrame()
-            
-        df = pd.concat(all_chunks, ignore_index=True)
-        
-        # 4. 标准清洗流程
-        if not df.empty:
-            # 统一转时间
-            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-            
-            # 强制去时区 (关键：防止和降雨数据打架)
-            if df['timestamp'].dt.tz is not None:
-                df['timestamp'] = df['timestamp'].dt.tz_localize(None)
-                
-            df['value'] = pd.to_numeric(df['value'], errors='coerce')
-            df = df.dropna(subset=['timestamp', 'value'])
-            
-            # 5. 【关键】数据量太大时，执行智能降采样
-            # 这一步能把 100万条数据浓缩成 5000个点，既保留形状，又让网页不卡顿
-            df = optimize_dataframe(df)
-            
-        return df
 
-    except Exception as e:
-        st.sidebar.error(f"⚠️ 分页读取中断: {e}")
-        # 即使报错，也尝试返回已经读到的部分数据
-        if all_chunks:
-            return pd.concat(all_chunks, ignore_index=True)
-        return pd.DataFrame()
-
-def get_rainfall_data(start_time, end_time):
-    if not supabase: return pd.DataFrame()
+def _fetch_sensor_rows(start_time, end_time, filters=None):
+    """从云端并发拉取 (start_time, end_time] 的原始数据并做标准清洗，出错直接抛出"""
+    fetcher = ShardedFetcher(get_client(), TABLE_SENSORS, "timestamp, sensor_id, variable_type, value, unit",
+                             order_cols=['sensor_id', 'variable_type'], numeric=['value'],
+                             page_size=FETCH_PAGE_SIZE, max_workers=FETCH_CONCURRENCY,
+                             catalog=catalogs[TABLE_SENSORS])
+    df, shards = _fetch_with_progress(fetcher, start_time, end_time, filters)
+    
+    if df.empty:
+        return pd.DataFrame(columns=['timestamp', 'sensor_id', 'variable_type', 'value', 'unit']), shards
+    
+    # 时间列已在解码时统一为不带时区的 UTC (防止和降雨数据打架)，value 为 float64，无法解析的为空
+    with span("fetch.parse", table=TABLE_SENSORS, rows=len(df)):
+        return df.dropna(subset=['timestamp', 'value']), shards
+
+def get_sensor_data(start_time, end_time, series=None, n_buckets=None, sync=True):
+    """series 为 (sensor_id, variable_type) 的集合时只拉取这些序列，None 表示全部。
+    给出 n_buckets (每条曲线的像素列数) 时，由规划器挑选足够精细的最粗汇总级别，
+    返回每个时间桶的 value_min / value_max / value(均值)；时段太短时仍返回原始数据。
+    同步出错时直接抛出；sync=False 时不访问数据库，只读本地已有的部分。"""
+    cache = local_cache[TABLE_SENSORS]
+    level = pick_level(start_time, end_time, n_buckets) if n_buckets else None
+    
+    # 1. 只拉取本地缓存里还没有的时间段 (高水位线之后的增量)，号码/物理量过滤下推到数据库
+    if sync:
+        if not get_client():
+            raise ConnectionError("数据库未连接")
+        with span("cache.sync", table=TABLE_SENSORS, level=level):
+            if level is None:
+                cache.sync(start_time, end_time, _fetch_sensor_rows, series=series)
+            else:
+                # 缺汇总的天按整天补齐原始数据，写入缓存时自动生成汇总
+                local_rollups[TABLE_SENSORS].refresh(start_time, end_time, series,
+                    lambda lo, hi: cache.sync(lo, hi, _fetch_sensor_rows, series=series))
+    
+    # 2. 从本地分区读出整个区间 (全分辨率，降采样留到清洗之后、绘图之前)
+    with span("cache.load", table=TABLE_SENSORS, level=level) as sp:
+        if level is None:
+            df = cache.load(start_time, end_time, series=series)
+        else:
+            df = local_rollups[TABLE_SENSORS].query(level, start_time, end_time, series,
+                lambda lo, hi: cache.load(lo, hi, series=series))
+        sp.set(rows=len(df))
+    return df
+
+def _fetch_rain_rows(start_time, end_time, filters=None):
+    # 与传感器数据一样分片分页拉取，长时段不再被单次请求的行数上限截断
+    # 同一时刻可能有多条记录，排序带上自增主键 id，翻页时跳过的行才是确定的
+    fetcher = ShardedFetcher(get_client(), TABLE_RAIN, "created_at, rain_intensity", time_col="created_at",
+                             order_cols=['id'], numeric=['rain_intensity'],
+                             page_size=FETCH_PAGE_SIZE, max_workers=FETCH_CONCURRENCY,
+                             catalog=catalogs[TABLE_RAIN])
+    df, shards = _fetch_with_progress(fetcher, start_time, end_time, filters, label="降雨记录")
+    with span("fetch.parse", table=TABLE_RAIN, rows=len(df)):
+        df = df.reindex(columns=['created_at', 'rain_intensity'])
+        df = df.rename(columns={"created_at": "timestamp", "rain_intensity": "value"})
+        df['timestamp'] = df['timestamp'].astype('datetime64[ns]')
+        df['value'] = df['value'].astype('float64')
+        return df.dropna(subset=['timestamp']), shards
+
+# 目录扫描的数据源：表名 -> (时间列, 要取的列, 排序主键列, 不能为空的列)
+# 目录要和缓存数一样的行：传感器缓存不存 value 为空的行 (见 _fetch_sensor_rows)，扫描时同样跳过
+CATALOG_SOURCES = {
+    TABLE_SENSORS: ("timestamp", "timestamp, sensor_id, variable_type, unit", ['sensor_id', 'variable_type'], ['value']),
+    TABLE_RAIN: ("created_at", "created_at", ['id'], []),
+}
+
+def _fetch_catalog_rows(table, client=None, progress=True):
+    # 后台线程里没有页面可画，progress=False 时不显示进度条
+    time_col, columns, order_cols, not_null = CATALOG_SOURCES[table]
+    fetcher = ShardedFetcher(client or get_client(), table, columns, time_col=time_col, order_cols=order_cols,
+                             page_size=FETCH_PAGE_SIZE, max_workers=FETCH_CONCURRENCY, not_null=not_null)
+    def fetch(lo, hi):
+        df = _fetch_with_progress(fetcher, lo, hi, label="目录记录")[0] if progress else fetcher.fetch(lo, hi)
+        return df.rename(columns={time_col: 'timestamp'})
+    return fetch
+
+def refresh_catalogs(max_age=None, rebuild=False):
+    """在当前线程更新各表的可用性目录 (只扫描主键列和时间列)，侧栏按钮用；max_age 秒内更新过的表跳过，出错直接抛出。
+    目录未建立时整表扫描一次；rebuild 时清空后整表重扫，并让与新目录不一致的缓存天失效"""
+    client = get_client()
+    if not client: return
+    for table, catalog in catalogs.items():
+        if rebuild:
+            catalog.clear()
+        if max_age is not None and catalog.refreshed and time.time() - catalog.refreshed < max_age:
+            continue
+        start = None
+        if catalog.through is None:
+            # 第一次扫描：只需知道表里最早的时刻
+            time_col = CATALOG_SOURCES[table][0]
+            first = client.table(table).select(time_col).order(time_col).limit(1).execute().data
+            if first:
+                start = pd.Timestamp(first[0][time_col])
+                start = start.tz_convert(None) if start.tz is not None else start
+        with span("catalog.refresh", table=table) as sp:
+            sp.set(rows=catalog.refresh(_fetch_catalog_rows(table), start=start))
+        if rebuild:
+            # 行数与重建后的目录对不上的缓存天 (绕过本应用写入过) 作废，下次读取时重新拉取
+            for day in catalog.stale_days(local_cache[table]):
+                invalidate_cache(pd.Timestamp(day), day_bounds(day)[1], table)
+
+def refresh_catalogs_in_background(max_age=CATALOG_MAX_AGE):
+    """已建立的目录超过 max_age 秒没更新时，起一个后台线程做增量扫描，页面加载不等它。
+    目录尚未建立时什么都不做：整表扫描只在点「更新目录」时进行"""
+    client = get_client()
+    if not client: return
+    stale = [(table, catalog) for table, catalog in catalogs.items() if catalog.through is not None
+             and not (catalog.refreshed and time.time() - catalog.refreshed < max_age)]
+    if not stale: return
+    state = catalog_refresher
+    with state["lock"]:
+        if state["thread"] is not None and state["thread"].is_alive(): return
+        def run():
+            # 后台线程不碰 st，结果直接写进进程级的目录
+            try:
+                for table, catalog in stale:
+                    catalog.refresh(_fetch_catalog_rows(table, client, progress=False))
+                state["error"] = None
+            except Exception as e:
+                state["error"] = e
+        state["thread"] = threading.Thread(target=run, name="catalog-refresh", daemon=True)
+        state["thread"].start()
+
+def _probe_series(start_time, end_time):
+    # 目录尚未建立时的退路：PostgREST 不支持 DISTINCT，取区间首尾各一批行探测 (采集器每个时刻写入全部通道)
+    client = get_client()
+    frames = []
+    if client:
+        try:
+            for desc in (False, True):
+                response = client.table(TABLE_SENSORS) \
+                    .select("sensor_id, variable_type, unit") \
+                    .gt("timestamp", start_time.isoformat()) \
+                    .lte("timestamp", end_time.isoformat()) \
+                    .order("timestamp", desc=desc) \
+                    .limit(SERIES_PROBE_ROWS).execute()
+                frames.append(pd.DataFrame(response.data, columns=['sensor_id', 'variable_type', 'unit']))
+        except Exception as e:
+            st.sidebar.error(f"⚠️ 序列列表读取失败: {e}")
+    return frames
+
+def get_series_list(start_time, end_time):
+    """列出时间段内可选的 (sensor_id, variable_type, unit) 及估计行数 rows，不下载数据本身。
+    来自可用性目录，再并上本地缓存里见过的序列 (目录不可用时至少能选已缓存的)；
+    目录尚未建立时改为探测区间首尾的行，这时没有行数估计。"""
+    catalog = catalogs[TABLE_SENSORS]
+    frames = [catalog.series(start_time, end_time)[['sensor_id', 'variable_type', 'unit', 'rows']]]
+    if catalog.through is None:
+        frames += _probe_series(start_time, end_time)
+    known = local_cache[TABLE_SENSORS].known_series(start_time, end_time, extra_cols=['unit'])
+    if not known.empty:
+        frames.append(known.astype(str))
+    series = pd.concat(frames, ignore_index=True).drop_duplicates(subset=['sensor_id', 'variable_type'])
+    return series.sort_values(['sensor_id', 'variable_type']).reset_index(drop=True)
+
+def get_rainfall_data(start_time, end_time, n_buckets=None):
+    """给出 n_buckets 时按规划器选择的汇总级别返回每个时间桶的累计降雨量"""
+    if not get_client(): return pd.DataFrame()
+    cache = local_cache[TABLE_RAIN]
+    # 缓存是左开区间，往前挪一微秒以包含 start_time 本身
+    start_time = start_time - timedelta(microseconds=1)
+    level = pick_level(start_time, end_time, n_buckets) if n_buckets else None
     try:
-        # 将 limit 从 500000 降为 200000
-        response = supabase.table(TABLE_RAIN).select("created_at, rain_intensity") \
-            .gte("created_at", start_time.isoformat()) \
-            .lte("created_at", end_time.isoformat()) \
-            .limit(200000) \
-            .order("created_at").execute()
-        
-        df = pd.DataFrame(response.data)
-        if not df.empty:
-            df = df.rename(columns={"created_at": "timestamp", "rain_intensity": "value"})
-            df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
-            if df['timestamp'].dt.tz is not None:
-                df['timestamp'] = df['timestamp'].dt.tz_localize(None)
-            df['value'] = pd.to_numeric(df['value'], errors='coerce')
-            df = df.dropna(subset=['timestamp'])
-            df = df.sort_values('timestamp')
-        return df
+        with span("cache.sync", table=TABLE_RAIN, level=level):
+            if level is None:
+                cache.sync(start_time, end_time, _fetch_rain_rows)
+            else:
+                local_rollups[TABLE_RAIN].refresh(start_time, end_time, None,
+                    lambda lo, hi: cache.sync(lo, hi, _fetch_rain_rows))
     except Exception as e:
         st.sidebar.error(f"降雨读取失败: {e}")
-        return pd.DataFrame()
-
-def parse_excel_file(uploaded_file):
-    try:
-        df = pd.read_excel(uploaded_file, header=2)
-    except Exception as e: return None, str(e)
-    df.columns.values[0] = 'timestamp_fixed'
-    processed_data = []
-    for col_name in df.columns[1:]:
-        col_str = str(col_name).strip()
-        if col_str.startswith("原始数据") or "Unnamed" in col_str: continue
-        match = REGEX_PATTERN.search(col_str)
-        if match:
-            raw_id, var_type, unit = match.group(1), match.group(2), match.group(4) if match.group(4) else ""
-            final_sensor_id = f"{raw_id}号"
-            current_series = pd.to_numeric(df[col_name], errors='coerce')
-            for ts, val in zip(df['timestamp_fixed'], current_series):
-                if pd.isna(ts): continue
-                processed_data.append({"timestamp": ts.isoformat() if hasattr(ts, 'isoformat') else str(ts), "sensor_id": final_sensor_id, "variable_type": var_type, "unit": unit, "value": None if pd.isna(val) else float(val)})
-    return processed_data, f"解析完成 {len(processed_data)} 条"
-
-def upload_to_supabase(data_list):
-    if not supabase: return False, "No Connection"
+    with span("cache.load", table=TABLE_RAIN, level=level) as sp:
+        if level is None:
+            df = cache.load(start_time, end_time)
+        else:
+            df = local_rollups[TABLE_RAIN].query(level, start_time, end_time, None, cache.load)
+        sp.set(rows=len(df))
+    if not df.empty:
+        df = df.sort_values('timestamp')
+    return df
+
+def get_rain_overlay(start_time, end_time, n_buckets, fetch_buckets=None):
+    """右轴降雨序列：按时间跨度和像素列数选统计间隔，累加成各间隔的降雨总量。
+    每次加载只算一次，所有图共用；返回 (DataFrame, 间隔名称)"""
+    df = get_rainfall_data(start_time, end_time, fetch_buckets)
+    if df.empty:
+        return pd.DataFrame(columns=['timestamp', 'value']), None
+    with span("rain.aggregate", rows=len(df)):
+        return interval_totals(df, start_time, end_time, n_buckets)
+
+def parse_excel_file(uploaded_files):
+    """解析一个或多个采集器导出文件，返回紧凑的长表 (DataFrame) 与提示信息"""
+    if not isinstance(uploaded_files, (list, tuple)):
+        uploaded_files = [uploaded_files]
+    from ingest import parse_excel_files
+    with span("parse.excel", files=len(uploaded_files), bytes=sum(getattr(f, "size", 0) or 0 for f in uploaded_files)) as sp:
+        data, msg = parse_excel_files(uploaded_files)
+        sp.set(rows=0 if data is None else len(data))
+    return data, msg
+
+def upload_to_supabase(data, progress=None):
+    """data 为 parse_excel_file 返回的长表；并发分批 upsert，失败自动重试，中断后可从检查点续传"""
+    client = get_client()
+    if not client: return False, "No Connection"
+    from ingest import to_records
+    from uploader import UploadPipeline
+    pipeline = UploadPipeline(client, TABLE_SENSORS, to_records, "timestamp, sensor_id, variable_type",
+                              checkpoint_dir=os.path.join(CACHE_DIR, "_uploads"), max_workers=UPLOAD_CONCURRENCY)
     try:
-        for i in range(0, len(data_list), 500):
-            supabase.table(TABLE_SENSORS).upsert(data_list[i:i+500], on_conflict="timestamp, sensor_id, variable_type", ignore_duplicates=True).execute()
-        return True, "Done"
+        with span("upload", rows=len(data)):
+            return pipeline.run(data, progress=progress)
     except Exception as e: return False, str(e)
-
-def process_data(series, window_size, spike_threshold):
-    # 建立副本，防止修改原始数据引发警告
-    series = series.copy()
-    
-    # 1. 改进版去噪：基于滚动中值的去尖峰 (Despiking)
-    if spike_threshold > 0:
-        # 强制使用至少窗口为5来进行异常检测，即便不做平滑，检测窗口也不能太小
-        despike_window = max(5, window_size)
-        
-        # 计算局部中值 (Rolling Median)
-        # 中值对尖峰极其不敏感，是判断是否为“异常值”的最佳基准
-        rolling_median = series.rolling(window=despike_window, center=True, min_periods=1).median()
-        
-        # 计算当前值与局部中值的 绝对偏差
-        deviation = (series - rolling_median).abs()
-        
-        # 找出偏差超过阈值的点 (这些就是尖峰)
-        outliers = deviation > spike_threshold
-        
-        # 【关键步骤】将尖峰替换为局部的中值
-        # 相比原来的置为 NaN，这样能保持曲线连贯，不会出现断点
-        if outliers.any():
-            series.loc[outliers] = rolling_median.loc[outliers]
-
-    # 2. 平滑处理 (保持原有逻辑：移动平均)
-    if window_size > 1:
-        series = series.rolling(window=window_size, min_periods=1, center=True).mean()
-        
-    return series
+    finally:
+        # 无论是否中断，已写入的批次可能覆盖了旧日期，对应缓存分区需要重新拉取；
+        # 目录按整份数据累加 (多计只会多发请求，少计会让抓取跳过有数据的时段)
+        if len(data):
+            invalidate_cache(data['timestamp'].min(), data['timestamp'].max())
+            catalogs[TABLE_SENSORS].add_rows(data)
+
+def process_data(series, window_size, spike_threshold, mad=False):
+    """单条序列的去尖峰 (滚动中值) + 平滑 (移动平均)，批量版本见 cleaning.clean_batch"""
+    values = series.to_numpy() if isinstance(series, pd.Series) else series
+    index = series.index if isinstance(series, pd.Series) else None
+    return pd.Series(clean_batch([values], window_size, spike_threshold, mad)[0], index=index)
+
+def build_panel_spec(config, store, keys, cleaned, n_buckets, ds_mode, rain_xy, font_path, rain_label=None):
+    """把一张图整理成只含数组的描述 (cleaned 为各序列清洗后的数值)，降采样后交给绘图进程"""
+    lines, plotted_vars, plotted_units = [], set(), set()
+    for sid, vtype in keys:
+        sub = store.get((sid, vtype))
+        if sub is None or not len(sub.v):
+            continue
+        y = cleaned[(sid, vtype)]
+        plotted_vars.add(vtype)
+        plotted_units.add(sub.unit)
+        line_color = SCI_COLORS[len(lines) % len(SCI_COLORS)]
+        # 清洗用全分辨率数据，画图前再按像素降采样
+        with span("downsample", rows=len(y), mode=ds_mode):
+            xs, ys = downsample(sub.t, y, n_buckets, ds_mode)
+        band = (sub.t, sub.vmin, sub.vmax) if sub.vmin is not None else (None, None, None)
+        lines.append((f"{sid}-{vtype} ({sub.unit})", line_color, xs, ys) + band)
+    if len(plotted_vars) == 1 and len(plotted_units) == 1:
+        y_label = f"{list(plotted_vars)[0]} ({list(plotted_units)[0]})"
+    else:
+        y_label = "数值 (Value)"
+    return {"title": config['title'], "ylabel": y_label, "lines": lines, "rain": rain_xy, "rain_label": rain_label,
+            "font": font_path, "figsize": FIG_SIZE, "dpi": FIG_DPI, "fmt": "png"}
 
 # ================= 4. 页面主程序 =================
-st.set_page_config(page_title="SciPlot Cloud", layout="wide")
-st.title("📊 SciPlot Cloud - 自动化科研绘图平台")
+CATALOG_LABELS = {'first': '最早', 'last': '最晚', 'rows': '行数', 'days': '天数', 'gaps': '缺测段'}
+
+def render_catalog():
+    """侧栏：数据范围和各序列概况直接读可用性目录，不再逐个查询数据库"""
+    c1, c2 = st.columns(2)
+    refresh = c1.button("🔍 更新目录")
+    rebuild = c2.button("♻️ 重建目录", help="清空目录后重新扫描整张表 (绕过本应用直接写库后使用)")
+    if refresh or rebuild:
+        try:
+            with st.spinner("正在扫描数据库..."):
+                refresh_catalogs(rebuild=rebuild)
+        except Exception as e:
+            st.error(f"目录更新失败: {e}")
+    sensors, rain = catalogs[TABLE_SENSORS].summary(), catalogs[TABLE_RAIN].summary()
+    if catalogs[TABLE_SENSORS].through is None:
+        st.caption("目录尚未建立：点击「更新目录」扫描一次整表，之后加载数据时在后台增量更新")
+        return
+    def date_range(df):
+        return f"{df['first'].min():%Y-%m-%d} -> {df['last'].max():%Y-%m-%d}" if not df.empty else '无'
+    st.info(f"传感器: {date_range(sensors)} ({len(sensors)} 个序列, {sensors['rows'].sum():,} 行)")
+    st.info(f"降雨: {date_range(rain)}")
+    if not sensors.empty:
+        with st.expander("📋 序列目录"):
+            st.dataframe(sensors.rename(columns=CATALOG_LABELS), hide_index=True)
+
+def render_diagnostics(recorder):
+    """侧栏诊断面板：本次运行各阶段的耗时 / 行数 / 字节数 / 内存增量 (可选分配峰值)，可导出 JSON lines"""
+    with st.sidebar.expander("🩺 性能诊断", expanded=recorder is not None):
+        st.checkbox("记录各阶段耗时与内存", key="diag_enabled", help="关闭时不做任何记录；内存只记常驻内存 (RSS) 的增量，开销可以忽略")
+        st.checkbox("跟踪内存分配峰值", key="diag_trace_memory", disabled=recorder is None,
+                    help="用 tracemalloc 记录各阶段的分配峰值。它是进程级的：开启期间所有会话都会明显变慢，只在排查内存问题时打开")
+        if recorder is None:
+            return
+        spans = recorder.last_run()
+        if spans:
+            df = pd.DataFrame(spans)
+            for col in ('rows', 'bytes', 'peak_bytes', 'rss_bytes'):
+                if col not in df.columns: df[col] = None
+            summary = df.groupby('name', sort=False).agg(
+                次数=('name', 'size'), 总耗时s=('seconds', 'sum'), 行数=('rows', 'sum'),
+                字节=('bytes', 'sum'), 内存增量MB=('rss_bytes', 'sum'), 峰值内存MB=('peak_bytes', 'max'))
+            summary['内存增量MB'] = summary['内存增量MB'] / 2**20
+            summary['峰值内存MB'] = summary['峰值内存MB'] / 2**20
+            st.dataframe(summary.round(3))
+        else:
+            st.caption("本次运行没有记录到阶段")
+        st.download_button("⬇️ 导出 JSON Lines", recorder.to_jsonl(), file_name="sciplot-spans.jsonl",
+                           mime="application/x-ndjson")
+        if st.button("清空记录"):
+            recorder.clear()
+
+def main():
+    # 诊断面板打开时才为本次运行启用记录器，关闭时 span() 全部是空操作
+    recorder = None
+    if st.session_state.get('diag_enabled'):
+        if 'diag_recorder' not in st.session_state:
+            st.session_state['diag_recorder'] = Recorder(session=uuid.uuid4().hex[:8])
+        recorder = st.session_state['diag_recorder']
+        # 分配峰值跟踪是进程级的，必须单独勾选才开启
+        recorder.trace_memory = bool(st.session_state.get('diag_trace_memory'))
+    token = activate(recorder) if recorder is not None else None
+    try:
+        render_page()
+    finally:
+        if token is not None:
+            deactivate(token)
+    render_diagnostics(recorder)
 
-if not supabase: st.stop()
+def render_page():
+    st.set_page_config(page_title="SciPlot Cloud", layout="wide")
+    st.title("📊 SciPlot Cloud - 自动化科研绘图平台")
 
-tab1, tab2 = st.tabs(["📈 数据绘图", "📂 数据上传"])
+    if not is_configured():
+        st.error("❌ 错误：请在配置区域填入你自己的 Supabase URL 和 Key！")
+        st.stop()
 
-with tab1:
-    with st.sidebar:
-        st.header("1. 数据库侦探")
-        if st.button("🔍 检测范围"):
-            try:
-                min_s = supabase.table(TABLE_SENSORS).select("timestamp").order("timestamp", desc=False).limit(1).execute()
-                max_s = supabase.table(TABLE_SENSORS).select("timestamp").order("timestamp", desc=True).limit(1).execute()
-                min_r = supabase.table(TABLE_RAIN).select("created_at").order("created_at", desc=False).limit(1).execute()
-                max_r = supabase.table(TABLE_RAIN).select("created_at").order("created_at", desc=True).limit(1).execute()
-                st.info(f"传感器: {min_s.data[0]['timestamp'][:10] if min_s.data else '无'} -> {max_s.data[0]['timestamp'][:10] if max_s.data else '无'}")
-                st.info(f"降雨: {min_r.data[0]['created_at'][:10] if min_r.data else '无'} -> {max_r.data[0]['created_at'][:10] if max_r.data else '无'}")
-            except: st.error("检测失败")
-
-        st.markdown("---")
-        st.header("2. 绘图控制")
+    tab1, tab2 = st.tabs(["📈 数据绘图", "📂 数据上传"])
+
+    with tab1:
+        with st.sidebar:
+            st.header("1. 数据库侦探")
+            render_catalog()
+
+            st.markdown("---")
+            st.header("2. 绘图控制")
         
-        default_start = datetime.now() - timedelta(days=30)
-        c1, c2 = st.columns(2)
-        start_date = c1.date_input("开始日期", default_start)
-        end_date = c2.date_input("结束日期", datetime.now())
-        show_rainfall = st.checkbox("叠加降雨量", value=True)
+            default_start = datetime.now() - timedelta(days=30)
+            c1, c2 = st.columns(2)
+            start_date = c1.date_input("开始日期", default_start)
+            end_date = c2.date_input("结束日期", datetime.now())
+            show_rainfall = st.checkbox("叠加降雨量", value=True)
+            use_rollup = st.checkbox("长时段使用预汇总数据", value=True, help="按时间跨度自动选择 1分钟/10分钟/1小时/1天 汇总，显示每个时间桶的均值和极值范围")
         
-        st.header("3. 数据清洗")
-        ma_window = st.slider("平滑窗口", 1, 20, 1)
-        spike_thresh = st.number_input("去噪阈值", 0.0, step=0.1)
-        plot_mode = st.radio("分窗逻辑", ["按【号码】自动分窗", "按【物理量】自动分窗", "自定义选择"])
+            st.header("3. 数据清洗")
+            ma_window = st.slider("平滑窗口", 1, 20, 1)
+            spike_thresh = st.number_input("去噪阈值", 0.0, step=0.1)
+            spike_mad = st.checkbox("阈值按局部 MAD 倍数计", value=False, help="勾选后偏离局部中值超过 阈值×1.4826×MAD 的点视为尖峰 (Hampel 滤波)；不勾选时阈值为绝对偏差")
+            ds_label = st.selectbox("降采样模式", list(DOWNSAMPLE_MODES))
+            plot_mode = st.radio("分窗逻辑", ["按【号码】自动分窗", "按【物理量】自动分窗", "自定义选择"])
         
-        st.markdown("---")
-        fetch_btn = st.button("🔄 刷新图表数据", type="primary", use_container_width=True)
-
-    if fetch_btn or 'raw_data' not in st.session_state:
-        with st.spinner("🚀 正在从云端拉取并优化数据 (上限50万条)..."):
-            t_start = datetime.combine(start_date, datetime.min.time())
-            t_end = datetime.combine(end_date, datetime.max.time())
+            st.markdown("---")
+            fetch_btn = st.button("🔄 刷新图表数据", type="primary", use_container_width=True)
+
+        if fetch_btn or 'series_store' not in st.session_state or st.session_state.get('use_rollup') != use_rollup:
+            with st.spinner("🚀 正在从云端拉取并优化数据..."):
+                t_start = datetime.combine(start_date, datetime.min.time())
+                t_end = datetime.combine(end_date, datetime.max.time())
+                # 规划器按每条曲线的像素列数选择汇总级别
+                n_buckets = point_budget(FIG_SIZE, FIG_DPI) if use_rollup else None
             
-            df_sensor = get_sensor_data(t_start, t_end)
-            df_rain = get_rainfall_data(t_start, t_end) if show_rainfall else pd.DataFrame()
+                # 先只取可选序列的列表 (来自可用性目录)，具体数据等绘图配置确定后按需加载
+                # 目录的增量更新在后台进行，这次加载用现有的目录
+                refresh_catalogs_in_background()
+                if catalog_refresher["error"] is not None:
+                    st.sidebar.error(f"⚠️ 数据目录更新失败: {catalog_refresher['error']}")
+                series_list = get_series_list(t_start, t_end)
+                df_rain, rain_interval = get_rain_overlay(t_start, t_end, point_budget(FIG_SIZE, FIG_DPI), n_buckets) \
+                    if show_rainfall else (pd.DataFrame(), None)
             
-            st.session_state['raw_data'] = df_sensor
-            st.session_state['rain_data'] = df_rain
+                st.session_state['use_rollup'] = use_rollup
+                st.session_state['rollup_budget'] = n_buckets
+                st.session_state['time_range'] = (t_start, t_end)
+                st.session_state['series_list'] = series_list
+                # 目录尚未建立时序列列表只是区间首尾的抽样，选项可能不全
+                st.session_state['series_sampled'] = catalogs[TABLE_SENSORS].through is None
+                # 旧句柄被替换后自动归还共享数据的引用
+                st.session_state['series_store'] = shared_store.acquire(None, t_start, t_end, [], None)
+                st.session_state['rain_data'] = df_rain
+                st.session_state['rain_interval'] = rain_interval
+                st.session_state['rain_version'] = array_version(df_rain['timestamp'].to_numpy(), df_rain['value'].to_numpy()) \
+                    if not df_rain.empty else None
             
-            if df_sensor.empty and df_rain.empty:
-                st.sidebar.warning("⚠️ 此时间段无数据")
-            else:
-                st.sidebar.success(f"✅ 就绪: 传感器{len(df_sensor)}条, 降雨{len(df_rain)}条")
-
-    if 'raw_data' in st.session_state:
-        df = st.session_state['raw_data']
-        df_rain = st.session_state.get('rain_data', pd.DataFrame())
+                if series_list.empty and df_rain.empty:
+                    st.sidebar.warning("⚠️ 此时间段无数据")
+                else:
+                    st.sidebar.success(f"✅ 就绪: 传感器{len(series_list)}个序列, 降雨{len(df_rain)}个{rain_interval or ''}时段")
+
+        if 'series_store' in st.session_state:
+            series_list = st.session_state.get('series_list', pd.DataFrame(columns=['sensor_id', 'variable_type', 'unit', 'rows']))
+            df_rain = st.session_state.get('rain_data', pd.DataFrame())
         
-        if not df.empty or not df_rain.empty:
-            all_ids = sorted(df['sensor_id'].unique()) if not df.empty else []
-            all_vars = sorted(df['variable_type'].unique()) if not df.empty else []
-            plots_config = []
-
-            if not df.empty:
-                if plot_mode == "自定义选择":
-                    num = st.number_input("窗口数量", 1, 10, 1)
-                    for i in range(num):
-                        c1, c2 = st.columns(2)
-                        ids = c1.multiselect(f"图{i+1} 号码", all_ids, key=f"id{i}")
-                        vars_ = c2.multiselect(f"图{i+1} 物理量", all_vars, key=f"v{i}")
-                        if ids and vars_: plots_config.append({"title":f"自定义窗口 {i+1}","ids":ids,"vars":vars_})
-                elif plot_mode == "按【号码】自动分窗":
-                    t_ids = st.multiselect("选择号码", all_ids, default=all_ids)
-                    t_vars = st.multiselect("选择物理量", all_vars, default=all_vars)
-                    for sid in t_ids: plots_config.append({"title":f"{sid} 数据","ids":[sid],"vars":t_vars})
-                elif plot_mode == "按【物理量】自动分窗":
-                    t_vars = st.multiselect("选择物理量", all_vars, default=all_vars)
-                    t_ids = st.multiselect("选择号码", all_ids, default=all_ids)
-                    for v in t_vars: plots_config.append({"title":f"{v} 对比","ids":t_ids,"vars":[v]})
-
-            if df.empty and not df_rain.empty:
-                plots_config.append({"title":"降雨量概览", "ids":[], "vars":[]})
-
-            if st.button("🎨 生成图表", key="btn_plot", type="primary") and plots_config:
-                num_plots = len(plots_config)
-                cols_per_row = 1 if num_plots == 1 else 2 if num_plots <= 4 else 3
+            if not series_list.empty or not df_rain.empty:
+                all_ids = sorted(series_list['sensor_id'].unique())
+                all_vars = sorted(series_list['variable_type'].unique())
+                plots_config = []
+
+                if st.session_state.get('series_sampled'):
+                    st.warning("⚠️ 数据目录尚未建立，序列列表只取自所选时段首尾的记录，只在中间时段出现的序列不会列出。"
+                               "在侧栏点击「更新目录」后重新加载可列出全部序列。")
+                if not series_list.empty:
+                    if plot_mode == "自定义选择":
+                        num = st.number_input("窗口数量", 1, 10, 1)
+                        for i in range(num):
+                            c1, c2 = st.columns(2)
+                            ids = c1.multiselect(f"图{i+1} 号码", all_ids, key=f"id{i}")
+                            vars_ = c2.multiselect(f"图{i+1} 物理量", all_vars, key=f"v{i}")
+                            if ids and vars_: plots_config.append({"title":f"自定义窗口 {i+1}","ids":ids,"vars":vars_})
+                    elif plot_mode == "按【号码】自动分窗":
+                        t_ids = st.multiselect("选择号码", all_ids, default=all_ids)
+                        t_vars = st.multiselect("选择物理量", all_vars, default=all_vars)
+                        for sid in t_ids: plots_config.append({"title":f"{sid} 数据","ids":[sid],"vars":t_vars})
+                    elif plot_mode == "按【物理量】自动分窗":
+                        t_vars = st.multiselect("选择物理量", all_vars, default=all_vars)
+                        t_ids = st.multiselect("选择号码", all_ids, default=all_ids)
+                        for v in t_vars: plots_config.append({"title":f"{v} 对比","ids":t_ids,"vars":[v]})
+
+                if series_list.empty and not df_rain.empty:
+                    plots_config.append({"title":"降雨量概览", "ids":[], "vars":[]})
+
+                # 按需加载：只取当前绘图配置用到、且本会话还没有的序列；
+                # 其他会话已加载过的 (同一汇总级别、覆盖本时段) 直接共享，不再拉取
+                store = st.session_state['series_store']
+                available = set(zip(series_list['sensor_id'], series_list['variable_type']))
+                wanted = {(sid, v) for cfg in plots_config for sid in cfg['ids'] for v in cfg['vars']} & available
+                missing = wanted - set(store.keys())
+                if wanted:
+                    picked = pd.MultiIndex.from_frame(series_list[['sensor_id', 'variable_type']]).isin(list(wanted))
+                    rows = series_list['rows'][picked]
+                    # 有序列的行数未知 (目录里没有) 时不给估计，免得显示成 0 行
+                    estimate = f"，原始数据约 {int(rows.sum()):,} 行" if rows.notna().all() else ""
+                    st.caption(f"已选 {len(wanted)} 个序列{estimate}")
+                if missing:
+                    t_start, t_end = st.session_state['time_range']
+                    budget = st.session_state['rollup_budget']
+                    level = pick_level(t_start, t_end, budget) if budget else None
+                    with st.spinner(f"📥 正在加载 {len(missing)} 个序列..."), span("load.series", series=len(missing)):
+                        try:
+                            handle = shared_store.acquire(level, t_start, t_end, missing,
+                                lambda keys: get_sensor_data(t_start, t_end, series=keys, n_buckets=budget))
+                        except Exception as e:
+                            st.sidebar.error(f"⚠️ 分页读取中断: {e}")
+                            # 即使报错，已经落盘的部分照样可以读出来；可能不完整，只短暂共享，之后重新拉取
+                            handle = shared_store.acquire(level, t_start, t_end, missing,
+                                lambda keys: get_sensor_data(t_start, t_end, series=keys, n_buckets=budget, sync=False),
+                                ttl=shared_store.live_ttl)
+                        store.absorb(handle)
+
+                if st.button("🎨 生成图表", key="btn_plot", type="primary") and plots_config:
+                    ds_mode = DOWNSAMPLE_MODES[ds_label]
+                    n_buckets = point_budget(FIG_SIZE, FIG_DPI)
+                    # 降雨序列加载时已按统计间隔累加好，所有图直接共用
+                    rain_xy, rain_version, rain_label = None, None, None
+                    if show_rainfall and not df_rain.empty:
+                        rain_xy = (df_rain['timestamp'].to_numpy(), df_rain['value'].to_numpy())
+                        rain_version = st.session_state.get('rain_version')
+                        # 每个点是一个统计间隔内的累计雨量，间隔随时间跨度变化，要写进单位里
+                        rain_interval = st.session_state.get('rain_interval')
+                        rain_label = f"降雨量 (mm/{rain_interval})" if rain_interval else "降雨量 (mm)"
+                    font_path = get_font_path()
+                    if font_path is None:
+                        st.warning("⚠️ 未找到中文字体，图中的中文会显示为方框。请安装 fonts-noto-cjk (见 packages.txt) 后重启，"
+                                   "或把 SimHei.ttf 放到应用目录。")
+                    num_plots = len(plots_config)
+                    cols_per_row = 1 if num_plots == 1 else 2 if num_plots <= 4 else 3
                 
-                for i in range(0, num_plots, cols_per_row):
-                    cols = st.columns(cols_per_row)
-                    for j in range(cols_per_row):
-                        if i + j < num_plots:
-                            config = plots_config[i + j]
-                            with cols[j]:
-                                # 黄金科研比例
-                                fig, ax1 = plt.subplots(figsize=(10, 6)) 
-                                
-                                has_sensor_data = False
-                                plotted_vars = set()
-                                plotted_units = set()
-                                color_idx = 0
-
-                                # 1. 画左轴 (科研配色 + 折线)
-                                if not df.empty:
-                                    for sid in config['ids']:
-                                        for vtype in config['vars']:
-                                            sub = df[(df['sensor_id']==sid)&(df['variable_type']==vtype)].sort_values('timestamp')
-                                            if not sub.empty:
-                                                has_sensor_data = True
-                                                y = process_data(sub['value'], ma_window, spike_thresh)
-                                                unit = sub['unit'].iloc[0] if pd.notna(sub['unit'].iloc[0]) else ""
-                                                plotted_vars.add(vtype)
-                                                plotted_units.add(unit)
-                                                
-                                                line_color = SCI_COLORS[color_idx % len(SCI_COLORS)]
-                                                color_idx += 1
-                                                
-                                                ax1.plot(sub['timestamp'], y, label=f"{sid}-{vtype} ({unit})", 
-                                                         color=line_color, linewidth=1.5, alpha=0.9)
-                                
-                                # 2. 画右轴 (降雨 - 纯折线，无Marker)
-                                ax2 = ax1.twinx()
-                                has_rain_data = False
-                                if show_rainfall and not df_rain.empty:
-                                    # 【核心修改】：纯折线，去掉 marker
-                                    ax2.plot(df_rain['timestamp'], df_rain['value'], 
-                                             color='#3C5488', # 深蓝
-                                             linestyle='-',   # 实线
-                                             linewidth=1.5,   # 稍粗一点，防止太细看不清
-                                             alpha=0.8,       # 不透明度稍高
-                                             label='降雨量 (mm)')
-                                    
-                                    # 保持 Y 轴从 0 开始
-                                    ax2.set_ylim(bottom=0)
-                                    has_rain_data = True
-                                
-                                # === 样式精修 ===
-                                fp = zh_font if zh_font else None
-                                
-                                if has_sensor_data:
-                                    if len(plotted_vars) == 1 and len(plotted_units) == 1:
-                                        y_label = f"{list(plotted_vars)[0]} ({list(plotted_units)[0]})"
-                                    else:
-                                        y_label = "数值 (Value)"
-                                    ax1.set_ylabel(y_label, fontproperties=fp, fontsize=12)
-                                else:
-                                    ax1.set_yticks([])
-                                
-                                ax1.set_xlabel("时间 (Time)", fontproperties=fp, fontsize=12)
-                                ax1.xaxis.set_major_locator(ticker.MaxNLocator(nbins=6)) 
-                                ax1.set_title(config['title'], fontproperties=fp, fontsize=14, fontweight='bold', pad=10)
-                                
-                                ax1.tick_params(axis='both', direction='in', which='both', top=True, right=False, labeltop=False, labelright=False)
-                                ax2.tick_params(axis='y', direction='in', right=True, labelright=False)
-                                
-                                if has_rain_data:
-                                    ax2.set_ylabel("降雨量 (mm)", fontproperties=fp, fontsize=12)
-                                else:
-                                    ax2.set_yticks([])
-                                
-                                ax1.grid(True, linestyle=':', alpha=0.3)
-                                
-                                if has_sensor_data or has_rain_data:
-                                    lines1, labels1 = ax1.get_legend_handles_labels()
-                                    lines2, labels2 = ax2.get_legend_handles_labels()
-                                    leg = ax1.legend(lines1 + lines2, labels1 + labels2, loc='best', frameon=False)
-                                    if fp:
-                                        for text in leg.get_texts(): text.set_fontproperties(fp)
-                                
-                                st.pyplot(fig)
-
-with tab2:
-    st.header("📂 上传新的 Excel 数据文件")
-    uploaded_file = st.file_uploader("拖拽文件到此处", type=['xls', 'xlsx'])
-    if uploaded_file:
-        data, msg = parse_excel_file(uploaded_file)
-        if data:
-            st.success(msg)
-            if st.button("🚀 确认上传"):
-                success, upload_msg = upload_to_supabase(data)
-                if success: st.success(upload_msg)
-                else: st.error(upload_msg)
-        else:
-            st.error(msg)
-
-
-
-
-
-
+                    # 先按输入内容算缓存键，缓存里没有的图整理成数组描述后一起交给进程池并行渲染
+                    jobs, todo = [], []
+                    for config in plots_config:
+                        keys = [(sid, vtype) for sid in config['ids'] for vtype in config['vars'] if (sid, vtype) in store]
+                        key = content_key([store.version(k) for k in keys], config, ma_window, spike_thresh, spike_mad,
+                                          ds_mode, rain_version, rain_label, FIG_SIZE, FIG_DPI, font_path)
+                        jobs.append(image_cache.get(key))
+                        if jobs[-1] is None:
+                            todo.append((len(jobs) - 1, config, keys, key))
+                
+                    # 这些图用到的序列一次批量清洗 (已清洗过的直接取记忆结果)
+                    clean_keys = list(dict.fromkeys(k for _, _, keys, _ in todo for k in keys))
+                    with span("clean", series=len(clean_keys), rows=sum(len(store.get(k).v) for k in clean_keys)):
+                        cleaned = dict(zip(clean_keys, cleaning.clean(
+                            [(store.version(k), store.get(k).v) for k in clean_keys], ma_window, spike_thresh, spike_mad)))
+                    for idx, config, keys, key in todo:
+                        jobs[idx] = renderer.submit(key, build_panel_spec(
+                            config, store, keys, cleaned, n_buckets, ds_mode, rain_xy, font_path, rain_label))
+                
+                    for i in range(0, num_plots, cols_per_row):
+                        cols = st.columns(cols_per_row)
+                        for j in range(cols_per_row):
+                            if i + j < num_plots:
+                                job = jobs[i + j]
+                                with cols[j]:
+                                    with span("render", cached=isinstance(job, bytes)) as sp:
+                                        image = job if isinstance(job, bytes) else job.result()
+                                        sp.set(bytes=len(image))
+                                    st.image(image, width="stretch")
+
+    with tab2:
+        st.header("📂 上传新的 Excel 数据文件")
+        uploaded_files = st.file_uploader("拖拽文件到此处 (可多选)", type=['xls', 'xlsx'], accept_multiple_files=True)
+        if uploaded_files:
+            data, msg = parse_excel_file(uploaded_files)
+            if data is not None and not data.empty:
+                st.success(msg)
+                if st.button("🚀 确认上传"):
+                    upload_text = st.empty()
+                    upload_bar = st.progress(0)
+                    def on_upload_progress(done, total, rate):
+                        upload_bar.progress(done / total)
+                        upload_text.text(f"📤 已写入 {done}/{total} 条 ({rate:,.0f} 条/秒)")
+                    success, upload_msg = upload_to_supabase(data, progress=on_upload_progress)
+                    upload_bar.empty()
+                    if success: st.success(upload_msg)
+                    else: st.error(upload_msg)
+            else:
+                st.error(msg)
 
 
+if __name__ == "__main__":
+    main()
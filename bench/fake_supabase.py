@@ -0,0 +1,231 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# ================= 本地 Supabase 替身 =================
+# 只实现 app 用到的 PostgREST 查询构造器：select / gt / gte / lt / lte / in_ / order / limit / range /
+# csv / upsert / execute，以及 select(count=...) 的行数估计。
+# csv() 与 PostgREST 一样返回 CSV 文本，时间为 Postgres 的文本格式 ("2024-07-01 00:00:00+00")。
+# 每张表是按 (时间, 主键) 排好序的 DataFrame，时间过滤用二分查找，几百万行也能快速分页。
+# latency (每次请求固定延迟) 与 per_row (每返回 / 写入一行的延迟) 用来模拟网络和数据库开销。
+
+TABLE_SCHEMAS = {
+    # 表名: (时间列, 主键列)
+    "sensor_measurements": ("timestamp", ["sensor_id", "variable_type"]),
+    "weather_logs": ("created_at", ["id"]),
+}
+# 自增主键：载入或写入时没有给出的按写入顺序编号
+IDENTITY = {"weather_logs": "id"}
+
+
+class Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _Table:
+    def __init__(self, name, df):
+        self.name = name
+        self.time_col, self.key_cols = TABLE_SCHEMAS.get(name, (df.columns[0], []))
+        self._pending = []
+        self._lock = threading.Lock()
+        self._set(df)
+
+    def _set(self, df):
+        df = df.copy()
+        identity = IDENTITY.get(self.name)
+        if identity:
+            ids = pd.to_numeric(df[identity], errors="coerce").to_numpy(dtype=float, copy=True) if identity in df \
+                else np.full(len(df), np.nan)
+            missing = np.isnan(ids)
+            start = 0 if missing.all() else int(np.nanmax(ids))
+            ids[missing] = np.arange(start + 1, start + 1 + missing.sum())
+            df[identity] = ids.astype(np.int64)
+        # 与 PostgREST 一样对外返回带时区的 ISO 字符串，内部另存一份 int64 纳秒用于二分
+        ts = pd.to_datetime(df[self.time_col], utc=True).dt.tz_localize(None).to_numpy(dtype="datetime64[ns]")
+        df[self.time_col] = np.char.add(np.datetime_as_string(ts, unit="s"), "+00:00").astype(object)
+        df["_t"] = ts.view(np.int64)
+        self.df = df.sort_values(["_t"] + self.key_cols, kind="stable").reset_index(drop=True)
+
+    def frame(self):
+        with self._lock:
+            if self._pending:
+                merged = pd.concat([self.df.drop(columns="_t"), pd.DataFrame(self._pending)], ignore_index=True)
+                # ignore_duplicates：已存在的主键保留旧行
+                merged = merged.drop_duplicates(subset=[self.time_col] + self.key_cols, keep="first")
+                self._pending = []
+                self._set(merged)
+            return self.df
+
+
+class Query:
+    def __init__(self, client, table):
+        self._client = client
+        self._table = table
+        self._filters = []
+        self._order = []
+        self._offset = 0
+        self._limit = None
+        self._count = None
+        self._columns = None
+        self._upsert = None
+        self._csv = False
+        self._negate = False
+
+    # ---------- 查询构造 ----------
+    def select(self, columns="*", count=None):
+        self._columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        self._count = count
+        return self
+
+    def _cmp(self, col, op, value):
+        self._filters.append((col, op, value))
+        return self
+
+    def gt(self, col, value): return self._cmp(col, "gt", value)
+    def gte(self, col, value): return self._cmp(col, "gte", value)
+    def lt(self, col, value): return self._cmp(col, "lt", value)
+    def lte(self, col, value): return self._cmp(col, "lte", value)
+    def eq(self, col, value): return self._cmp(col, "eq", value)
+    def in_(self, col, values): return self._cmp(col, "in", list(values))
+
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def is_(self, col, value):
+        # 只支持 is.null / not.is.null
+        op, self._negate = ("not.is" if self._negate else "is"), False
+        return self._cmp(col, op, value)
+
+    def order(self, col, desc=False):
+        self._order.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def range(self, start, end):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def csv(self):
+        self._csv = True
+        return self
+
+    def upsert(self, records, on_conflict=None, ignore_duplicates=False):
+        self._upsert = records
+        return self
+
+    # ---------- 执行 ----------
+    def _rows(self):
+        table = self._client.table_data(self._table)
+        df = table.frame()
+        t = df["_t"].to_numpy()
+        lo, hi = 0, len(df)
+        rest = []
+        for col, op, value in self._filters:
+            if col != table.time_col or op not in ("gt", "gte", "lt", "lte"):
+                rest.append((col, op, value))
+                continue
+            ts = pd.Timestamp(value)
+            v = (ts.tz_convert(None) if ts.tz is not None else ts).value
+            if op == "gt": lo = max(lo, int(np.searchsorted(t, v, side="right")))
+            elif op == "gte": lo = max(lo, int(np.searchsorted(t, v, side="left")))
+            elif op == "lt": hi = min(hi, int(np.searchsorted(t, v, side="left")))
+            else: hi = min(hi, int(np.searchsorted(t, v, side="right")))
+        df = df.iloc[lo:max(lo, hi)]
+        for col, op, value in rest:
+            if op == "in":
+                df = df[df[col].isin(value)]
+            elif op in ("is", "not.is"):
+                df = df[df[col].isna() == (op == "is")]
+            else:
+                df = df[df[col] == value]
+        return table, df
+
+    def _sorted(self, table, df):
+        if not self._order:
+            return df
+        cols = [c for c, _ in self._order]
+        descs = [d for _, d in self._order]
+        natural = [table.time_col] + table.key_cols
+        if cols == natural[:len(cols)] and not any(descs):
+            return df
+        if cols == natural[:len(cols)] and all(descs):
+            return df.iloc[::-1]
+        sort_cols = ["_t" if c == table.time_col else c for c in cols]
+        return df.sort_values(sort_cols, ascending=[not d for d in descs], kind="stable")
+
+    def execute(self):
+        client = self._client
+        with client._lock:
+            client.requests += 1
+        if self._upsert is not None:
+            table = client.table_data(self._table)
+            with table._lock:
+                table._pending.extend(self._upsert)
+            client._sleep(client.latency + client.per_row * len(self._upsert))
+            return Response([])
+        table, df = self._rows()
+        count = len(df) if self._count else None
+        df = self._sorted(table, df)
+        stop = None if self._limit is None else self._offset + self._limit
+        df = df.iloc[self._offset:stop]
+        columns = [c for c in (self._columns or df.columns) if c != "_t"]
+        if self._csv:
+            data = _to_csv(df, columns, table.time_col)
+        else:
+            data = df[columns].to_dict("records")
+        client._sleep(client.latency + client.per_row * len(df))
+        return Response(data, count)
+
+
+def _to_csv(df, columns, time_col):
+    if df.empty:
+        return ",".join(columns) + "\n"
+    t = df["_t"].to_numpy()
+    ts = np.datetime_as_string(t.view("datetime64[ns]"), unit="s" if not (t % 1_000_000_000).any() else "us")
+    pg_time = np.char.add(np.char.replace(ts, "T", " "), "+00")
+    arrays = [pa.array(pg_time) if c == time_col else pa.array(df[c], from_pandas=True) for c in columns]
+    out = pa.BufferOutputStream()
+    pacsv.write_csv(pa.table(arrays, names=columns), out, pacsv.WriteOptions(quoting_style="needed"))
+    return out.getvalue().to_pybytes().decode()
+
+
+class FakeSupabase:
+    """client.table(name) 返回查询构造器；用 load() 放入各表数据"""
+
+    def __init__(self, latency=0.0, per_row=0.0, sleep=time.sleep):
+        self.latency = latency
+        self.per_row = per_row
+        self._tables = {}
+        self._lock = threading.Lock()   # 并发的首次写入不能各自建一张空表
+        self._do_sleep = sleep
+        self.requests = 0
+
+    def _sleep(self, seconds):
+        if seconds > 0:
+            self._do_sleep(seconds)
+
+    def load(self, name, df):
+        table = _Table(name, df)
+        with self._lock:
+            self._tables[name] = table
+
+    def table_data(self, name):
+        with self._lock:
+            if name not in self._tables:
+                time_col, key_cols = TABLE_SCHEMAS.get(name, ("timestamp", []))
+                self._tables[name] = _Table(name, pd.DataFrame(columns=[time_col] + key_cols))
+            return self._tables[name]
+
+    def table(self, name):
+        return Query(self, name)
@@ -0,0 +1,330 @@
+"""SciPlot 性能基准
+
+    python -m bench.run                                  # 默认规模 1万 / 10万 / 100万 / 500万 行
+    python -m bench.run --sizes 10000,100000 --out bench.json
+    python -m bench.run --baseline bench.json --tolerance 0.2   # 与上次结果对比，变慢超过 20% 时退出码为 1
+
+所有场景都在进程内运行：数据库换成 bench.fake_supabase (可加网络延迟)，数据由 bench.synth 生成。
+启动耗时 (冷启动首屏、每次重跑脚本的开销) 见 python -m bench.startup。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from bench.fake_supabase import FakeSupabase
+from bench import synth
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+
+
+# ---------- 载入 app (不运行页面) ----------
+def load_app(client, cache_dir):
+    os.environ["SCIPLOT_CACHE_DIR"] = cache_dir
+    import supabase
+    supabase.create_client = lambda url, key: client
+    import app
+    return app
+
+
+def reset_state(app, cache_dir):
+    """换一个空的缓存目录并重建进程级单例，保证每次计时都是冷启动"""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    app.CACHE_DIR = cache_dir
+    for init, name in ((app.init_local_cache, "local_cache"), (app.init_rollups, "local_rollups"),
+                       (app.init_catalogs, "catalogs"), (app.init_shared_store, "shared_store"),
+                       (app.init_cleaning, "cleaning")):
+        init.clear()
+        setattr(app, name, init())
+
+
+def _span(df, col):
+    ts = pd.to_datetime(df[col])
+    return ts.min() - pd.Timedelta(microseconds=1), ts.max()
+
+
+# ---------- 场景 ----------
+# 每个场景：setup(ctx, n) 做不计时的准备并返回 run()；max_rows 之上的规模跳过 (例如写 500 万格的 Excel 太慢)
+class Scenario:
+    def __init__(self, name, setup, max_rows=None):
+        self.name, self.setup, self.max_rows = name, setup, max_rows
+
+
+def _sensor_setup(n_buckets=None, warm=False):
+    def setup(ctx, n):
+        app, client = ctx["app"], ctx["client"]
+        rows = synth.sensor_rows(n)
+        client.load(app.TABLE_SENSORS, rows)
+        start, end = _span(rows, "timestamp")
+        reset_state(app, ctx["cache_dir"])
+        if warm:
+            app.get_sensor_data(start, end, n_buckets=n_buckets)
+        return lambda: {"rows_out": len(app.get_sensor_data(start, end, n_buckets=n_buckets))}
+    return setup
+
+
+def _catalog_setup(ctx, n):
+    # 可用性目录的首次整表扫描
+    app, client = ctx["app"], ctx["client"]
+    client.load(app.TABLE_SENSORS, synth.sensor_rows(n))
+    reset_state(app, ctx["cache_dir"])
+    def run():
+        app.refresh_catalogs(rebuild=True)
+        return {"series": len(app.catalogs[app.TABLE_SENSORS].summary())}
+    return run
+
+
+def _rain_setup(ctx, n):
+    app, client = ctx["app"], ctx["client"]
+    rows = synth.rain_rows(n)
+    client.load(app.TABLE_RAIN, rows)
+    start, end = _span(rows, "created_at")
+    reset_state(app, ctx["cache_dir"])
+    budget = app.point_budget(app.FIG_SIZE, app.FIG_DPI)
+    def run():
+        df, _ = app.get_rain_overlay(start, end, budget)
+        return {"rows_out": len(df)}
+    return run
+
+
+def _series_arrays(n):
+    rows = synth.sensor_rows(n)
+    groups = rows.groupby(["sensor_id", "variable_type"], sort=False)
+    return [(sub["timestamp"].to_numpy(), sub["value"].to_numpy()) for _, sub in groups]
+
+
+def _downsample_setup(ctx, n):
+    app, series = ctx["app"], _series_arrays(n)
+    budget = app.point_budget(app.FIG_SIZE, app.FIG_DPI)
+    return lambda: {"points_out": sum(len(app.downsample(t, v, budget, "minmax")[0]) for t, v in series)}
+
+
+def _process_data_setup(ctx, n):
+    app, series = ctx["app"], _series_arrays(n)
+    return lambda: {"series": len([app.process_data(v, 5, 0.5) for _, v in series])}
+
+
+def _clean_batch_setup(ctx, n):
+    from cleaning import clean_batch
+    series = [v for _, v in _series_arrays(n)]
+    return lambda: {"series": len(clean_batch(series, 5, 0.5))}
+
+
+def _decode_setup(fmt):
+    # 只计解码：按抓取页大小切好的 CSV 文本 / JSON 行，解码并拼成 DataFrame
+    def setup(ctx, n):
+        from bench.fake_supabase import _to_csv
+        from wire import column_types, decode_csv, decode_json, to_frame
+        app = ctx["app"]
+        rows = synth.sensor_rows(n)
+        columns = ["timestamp", "sensor_id", "variable_type", "value", "unit"]
+        types = column_types(columns, "timestamp", numeric=["value"])
+        rows["_t"] = rows["timestamp"].to_numpy().view(np.int64)
+        step = app.FETCH_PAGE_SIZE
+        pages = [rows.iloc[i:i + step] for i in range(0, len(rows), step)]
+        if fmt == "csv":
+            pages = [_to_csv(p, columns, "timestamp") for p in pages]
+            decode = decode_csv
+        else:
+            pages = [p.assign(timestamp=p["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S+00:00"))[columns].to_dict("records")
+                     for p in pages]
+            decode = decode_json
+        return lambda: {"rows_decoded": len(to_frame([decode(p, types) for p in pages], types))}
+    return setup
+
+
+def _excel_setup(ctx, n):
+    app = ctx["app"]
+    path = os.path.join(ctx["work_dir"], f"logger-{n}.xlsx")
+    if not os.path.exists(path):
+        synth.write_logger_excel(path, n)
+    def run():
+        df, msg = app.parse_excel_file([path])
+        return {"rows_out": 0 if df is None else len(df)}
+    return run
+
+
+def _upload_setup(ctx, n):
+    from ingest import LONG_COLUMNS
+    app, client = ctx["app"], ctx["client"]
+    data = synth.sensor_rows(n)[LONG_COLUMNS]
+    for col in ("sensor_id", "variable_type", "unit"):
+        data[col] = data[col].astype("category")
+    reset_state(app, ctx["cache_dir"])
+    client.load(app.TABLE_SENSORS, data.iloc[0:0])
+    def run():
+        ok, msg = app.upload_to_supabase(data)
+        if not ok:
+            raise RuntimeError(msg)
+        return {"rows_in": len(data)}
+    return run
+
+
+def _render_setup(ctx, n):
+    from render import ImageCache, Renderer, content_key
+    app = ctx["app"]
+    rows = synth.sensor_rows(n)
+    reset_state(app, ctx["cache_dir"])
+    start, end = _span(rows, "timestamp")
+    keys = set(zip(rows["sensor_id"], rows["variable_type"]))
+    store = app.shared_store.acquire(None, start, end, keys, lambda _: rows)
+    budget = app.point_budget(app.FIG_SIZE, app.FIG_DPI)
+    sids = sorted(rows["sensor_id"].unique())
+    configs = [{"title": f"{sid} 数据", "ids": [sid], "vars": sorted(rows["variable_type"].unique())}
+               for sid in (sids * 9)[:9]]
+    cleaned = {k: store.get(k).v.astype(np.float64) for k in keys}
+    specs = [app.build_panel_spec(cfg, store, [(s, v) for s in cfg["ids"] for v in cfg["vars"]],
+                                  cleaned, budget, "minmax", None, None) for cfg in configs]
+    renderer = ctx.setdefault("renderer", Renderer(ImageCache(1 << 30), max_workers=ctx["render_workers"]))
+    # 先画一张让工作进程启动完毕，计时只算渲染本身
+    renderer.submit("warmup", specs[0]).result()
+    def run():
+        renderer.cache = ImageCache(1 << 30)
+        jobs = [renderer.submit(content_key(i, time.time()), spec) for i, spec in enumerate(specs)]
+        return {"panels": len(jobs), "bytes": sum(len(job.result()) for job in jobs)}
+    return run
+
+
+SCENARIOS = [
+    Scenario("get_sensor_data.cold", _sensor_setup()),
+    Scenario("get_sensor_data.warm", _sensor_setup(warm=True)),
+    Scenario("get_sensor_data.rollup", _sensor_setup(n_buckets=800)),
+    Scenario("get_rainfall_data", _rain_setup),
+    Scenario("catalog.refresh", _catalog_setup),
+    # optimize_dataframe 已由按序列的 downsample 取代
+    Scenario("downsample", _downsample_setup),
+    Scenario("process_data", _process_data_setup),
+    Scenario("clean_batch", _clean_batch_setup),
+    Scenario("decode.csv", _decode_setup("csv")),
+    Scenario("decode.json", _decode_setup("json")),
+    Scenario("parse_excel_file", _excel_setup, max_rows=1_000_000),
+    Scenario("upload_to_supabase", _upload_setup, max_rows=1_000_000),
+    Scenario("render.9_panels", _render_setup),
+]
+
+
+# ---------- 运行与对比 ----------
+def run_scenario(scenario, ctx, n, repeat):
+    run = scenario.setup(ctx, n)
+    times, extra = [], {}
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        extra = run() or {}
+        times.append(time.perf_counter() - t0)
+    if "rows_decoded" in extra:
+        # 解码吞吐量：百万行 / 秒
+        extra["mrows_per_s"] = extra["rows_decoded"] / min(times) / 1e6
+    return {"scenario": scenario.name, "rows": n, "seconds": min(times), "runs": times, **extra}
+
+
+def compare(results, baseline, tolerance):
+    """按 (场景, 行数) 对比，耗时超过基线 (1 + tolerance) 倍记为退化；基线有耗时而这次出错也算退化 (ratio 为 None)"""
+    base = {(r["scenario"], r["rows"]): r for r in baseline.get("results", []) if "seconds" in r}
+    report = []
+    for r in results:
+        old = base.get((r["scenario"], r["rows"]))
+        if old is None:
+            continue
+        if "error" in r:
+            r.update(baseline_seconds=old["seconds"], ratio=None, regression=True)
+            report.append(r)
+            continue
+        if "seconds" not in r:
+            continue
+        ratio = r["seconds"] / old["seconds"] if old["seconds"] > 0 else float("inf")
+        r["baseline_seconds"] = old["seconds"]
+        r["ratio"] = ratio
+        r["regression"] = ratio > 1 + tolerance
+        report.append(r)
+    return report
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SciPlot 性能基准")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="逗号分隔的行数")
+    parser.add_argument("--scenarios", default="", help="只运行名称包含这些片段的场景 (逗号分隔)")
+    parser.add_argument("--repeat", type=int, default=3, help="每个规模重复次数，取最快一次")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟每次请求的网络延迟 (秒)")
+    parser.add_argument("--per-row", type=float, default=0.0, help="模拟每行的传输延迟 (秒)")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--baseline", help="上次的结果文件，用于对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的变慢比例")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    wanted = [s for s in args.scenarios.split(",") if s]
+    scenarios = [s for s in SCENARIOS if not wanted or any(w in s.name for w in wanted)]
+
+    work_dir = tempfile.mkdtemp(prefix="sciplot-bench-")
+    client = FakeSupabase(latency=args.latency, per_row=args.per_row)
+    ctx = {"client": client, "work_dir": work_dir, "cache_dir": os.path.join(work_dir, "cache"),
+           "render_workers": args.render_workers}
+    ctx["app"] = load_app(client, ctx["cache_dir"])
+
+    results = []
+    try:
+        for scenario in scenarios:
+            for n in sizes:
+                if scenario.max_rows and n > scenario.max_rows:
+                    results.append({"scenario": scenario.name, "rows": n, "skipped": f"超过 {scenario.max_rows} 行上限"})
+                    continue
+                try:
+                    r = run_scenario(scenario, ctx, n, args.repeat)
+                except Exception as e:
+                    r = {"scenario": scenario.name, "rows": n, "error": repr(e)}
+                results.append(r)
+                shown = f"{r['seconds']:.3f}s" if "seconds" in r else r.get("error") or r.get("skipped")
+                if "mrows_per_s" in r:
+                    shown += f"  ({r['mrows_per_s']:.2f} M 行/秒)"
+                print(f"{scenario.name:<26} {n:>9,} 行  {shown}", flush=True)
+    finally:
+        if "renderer" in ctx:
+            ctx["renderer"].shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        "meta": {"commit": _git_commit(), "python": sys.version.split()[0], "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "latency": args.latency, "per_row": args.per_row,
+                 "repeat": args.repeat, "created": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report = compare(results, json.load(f), args.tolerance)
+        regressions = [r for r in report if r["regression"]]
+        output["regressions"] = [{"scenario": r["scenario"], "rows": r["rows"],
+                                  "ratio": None if r["ratio"] is None else round(r["ratio"], 3), "error": r.get("error")}
+                                 for r in regressions]
+        for r in regressions:
+            if r["ratio"] is None:
+                print(f"⚠️ 退化 {r['scenario']} {r['rows']:,} 行: 基线 {r['baseline_seconds']:.3f}s，这次出错 {r['error']}")
+            else:
+                print(f"⚠️ 退化 {r['scenario']} {r['rows']:,} 行: {r['baseline_seconds']:.3f}s -> {r['seconds']:.3f}s ({r['ratio']:.2f}x)")
+        status = 1 if regressions else 0
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=1)
+    print(f"结果已写入 {args.out}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
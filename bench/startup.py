@@ -0,0 +1,131 @@
+"""SciPlot 启动基准
+
+    python -m bench.startup                                # 冷启动首屏耗时 + 无交互重跑脚本的开销
+    python -m bench.startup --repeat 5 --reruns 20 --out startup.json
+    python -m bench.startup --baseline startup.json --tolerance 0.2   # 与上次结果对比，变慢超过 20% 时退出码为 1
+
+每次冷启动都在新的解释器里：用 streamlit 的 AppTest 运行 app.py 直到第一屏渲染完毕 (数据库换成空的本地替身)。
+计时不含 streamlit 本身的导入 (服务端在运行脚本之前已经导入)。之后在同一进程里无交互地重跑若干次，
+中位数即每次交互的脚本开销。子进程里禁止网络连接并记录尝试次数，同时报告首屏时已经导入的重量级模块。
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 首屏不应该用到的依赖
+HEAVY_MODULES = ["matplotlib", "supabase", "postgrest", "openpyxl", "xlrd", "scipy", "requests"]
+
+
+# ---------- 子进程：一次冷启动 ----------
+def _child(reruns):
+    attempts = []
+
+    def refuse(sock, address):
+        attempts.append(str(address))
+        raise OSError("bench.startup 禁止网络连接")
+    socket.socket.connect = refuse
+    socket.socket.connect_ex = refuse
+    socket.getaddrinfo = lambda host, *args, **kwargs: refuse(None, host)
+
+    def create_client(url, key):
+        # 替身不导入 supabase，这里补上真实客户端依赖 (postgrest / httpx) 的导入开销
+        import postgrest  # noqa: F401
+        from bench.fake_supabase import FakeSupabase
+        return FakeSupabase()
+    stub = types.ModuleType("supabase")
+    stub.create_client = create_client
+
+    from streamlit.testing.v1 import AppTest
+
+    os.environ["SCIPLOT_CACHE_DIR"] = tempfile.mkdtemp(prefix="sciplot-startup-")
+    before = set(sys.modules)
+    sys.modules["supabase"] = stub
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    t0 = time.perf_counter()
+    at.run()
+    first_paint = time.perf_counter() - t0
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    heavy = sorted(m for m in HEAVY_MODULES if m in sys.modules and m not in before and m != "supabase")
+    reruns_s = []
+    for _ in range(reruns):
+        t0 = time.perf_counter()
+        at.run()
+        reruns_s.append(time.perf_counter() - t0)
+    return {"first_paint": first_paint, "reruns": reruns_s, "heavy_modules": heavy, "network_attempts": attempts}
+
+
+def _spawn(reruns):
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-m", "bench.startup", "--child", "--reruns", str(reruns)],
+                          cwd=ROOT, capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["process"] = wall
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SciPlot 启动基准")
+    parser.add_argument("--repeat", type=int, default=3, help="冷启动次数，首屏取最快一次")
+    parser.add_argument("--reruns", type=int, default=10, help="每次冷启动后无交互重跑的次数")
+    parser.add_argument("--out", default="bench-startup.json")
+    parser.add_argument("--baseline", help="上次的结果文件，用于对比")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的变慢比例")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(_child(args.reruns), ensure_ascii=False))
+        return 0
+
+    from bench.run import _git_commit, compare
+
+    runs = [_spawn(args.reruns) for _ in range(args.repeat)]
+    first = [r["first_paint"] for r in runs]
+    reruns = [t for r in runs for t in r["reruns"]]
+    results = [
+        {"scenario": "startup.first_paint", "rows": 0, "seconds": min(first), "runs": first,
+         "process_seconds": min(r["process"] for r in runs)},
+        {"scenario": "startup.rerun", "rows": 0, "seconds": statistics.median(reruns), "runs": reruns},
+    ]
+    heavy = sorted({m for r in runs for m in r["heavy_modules"]})
+    network = sum(len(r["network_attempts"]) for r in runs)
+    print(f"首屏 (冷启动)      {min(first):.3f}s   (含解释器与 streamlit 导入 {results[0]['process_seconds']:.3f}s)")
+    print(f"每次重跑脚本        {results[1]['seconds'] * 1000:.1f}ms (中位数，{len(reruns)} 次)")
+    print(f"首屏导入的重量级模块  {', '.join(heavy) or '无'}")
+    print(f"网络连接尝试        {network}")
+
+    output = {
+        "meta": {"commit": _git_commit(), "python": sys.version.split()[0], "cpus": os.cpu_count(),
+                 "repeat": args.repeat, "reruns": args.reruns, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "heavy_modules": heavy, "network_attempts": network},
+        "results": results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report = compare(results, json.load(f), args.tolerance)
+        regressions = [r for r in report if r["regression"]]
+        output["regressions"] = [{"scenario": r["scenario"], "ratio": round(r["ratio"], 3)} for r in regressions]
+        for r in regressions:
+            print(f"⚠️ 退化 {r['scenario']}: {r['baseline_seconds']:.3f}s -> {r['seconds']:.3f}s ({r['ratio']:.2f}x)")
+        status = 1 if regressions else 0
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=1)
+    print(f"结果已写入 {args.out}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+# ================= 合成数据 =================
+# 与线上表结构一致的传感器长表 / 降雨记录，以及采集器导出格式的 Excel 宽表
+# (第 3 行表头，第 1 列时间，其余列名形如 "1号温度 温度(℃)"，能被 ingest.REGEX_PATTERN 匹配)。
+# 同一 seed 生成的数据完全相同，便于前后两次基准结果对比。
+
+VARIABLES = [("温度", "温度", "℃"), ("湿度", "湿度", "%"), ("含水率", "含水", "%"), ("孔压", "压力", "kPa")]
+
+
+def series_keys(n_sensors, n_vars):
+    return [(f"{i + 1}号", VARIABLES[j % len(VARIABLES)][0], VARIABLES[j % len(VARIABLES)][2])
+            for i in range(n_sensors) for j in range(n_vars)]
+
+
+def _walk(rng, n, spikes=0.002):
+    # 随机游走 + 日周期 + 偶发尖峰，去尖峰和降采样才有事可做
+    y = np.cumsum(rng.normal(0, 0.05, n)) + 2 * np.sin(np.arange(n) * 2 * np.pi / 1440)
+    hit = rng.random(n) < spikes
+    y[hit] += rng.choice([-1, 1], hit.sum()) * rng.uniform(5, 20, hit.sum())
+    return y
+
+
+def sensor_rows(n_rows, n_sensors=8, n_vars=4, freq="1min", end="2024-07-01", seed=0):
+    """约 n_rows 行的 sensor_measurements：n_sensors × n_vars 条序列，各序列时间轴相同"""
+    rng = np.random.default_rng(seed)
+    keys = series_keys(n_sensors, n_vars)
+    n_times = max(1, n_rows // len(keys))
+    times = pd.date_range(end=pd.Timestamp(end), periods=n_times, freq=freq)
+    frames = []
+    for sid, vtype, unit in keys:
+        frames.append(pd.DataFrame({
+            "timestamp": times,
+            "sensor_id": sid,
+            "variable_type": vtype,
+            "value": _walk(rng, n_times),
+            "unit": unit,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def rain_rows(n_rows, freq="1min", end="2024-07-01", seed=1):
+    """weather_logs：大部分时刻无雨，偶有成段降雨"""
+    rng = np.random.default_rng(seed)
+    times = pd.date_range(end=pd.Timestamp(end), periods=max(1, n_rows), freq=freq)
+    raining = np.repeat(rng.random(len(times) // 60 + 1) < 0.2, 60)[:len(times)]
+    return pd.DataFrame({"created_at": times, "rain_intensity": np.where(raining, rng.gamma(1.5, 0.2, len(times)), 0.0)})
+
+
+def write_logger_excel(path, n_rows, n_sensors=8, n_vars=4, freq="1min", end="2024-07-01", seed=2):
+    """写一个采集器格式的 xlsx：宽表共 n_rows 个数值 (时间行数 × 通道数)"""
+    from openpyxl import Workbook
+
+    rng = np.random.default_rng(seed)
+    keys = [(i + 1, VARIABLES[j % len(VARIABLES)]) for i in range(n_sensors) for j in range(n_vars)]
+    n_times = max(1, n_rows // len(keys))
+    times = pd.date_range(end=pd.Timestamp(end), periods=n_times, freq=freq).to_pydatetime()
+    values = np.column_stack([_walk(rng, n_times) for _ in keys]).round(3)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("数据")
+    ws.append(["采集器导出"])
+    ws.append(["原始数据"])
+    ws.append(["时间"] + [f"{i}号{var} {word}({unit})" for i, (var, word, unit) in keys])
+    for t, row in zip(times, values.tolist()):
+        ws.append([t] + row)
+    wb.save(path)
+    return path
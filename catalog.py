@@ -0,0 +1,359 @@
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from local_cache import ONE_US, day_bounds
+
+# ================= 序列可用性目录 =================
+# 每个序列 (主键列 + 附属列，如 unit) 记录：
+#   daily.parquet   每天的行数、首末时刻
+#   runs.parquet    连续有数据的时段 (相邻两点间隔不超过 gap 视为连续)，时段之间就是缺测区间
+#   _state.json     through：through 之前的数据目录是完整的；refreshed：上次扫描数据库的时间
+# 三种更新途径：
+#   refresh()      从 through 所在那天往前 lookback 起扫描数据库的主键列，覆盖这些天的计数
+#                  (首次整表扫描由用户点按钮触发，之后的增量扫描在后台线程里做)
+#   缓存写入回调     本地缓存某天某序列完整时，用分区数据覆盖该序列当天的计数
+#   add_rows()     上传的数据直接累加 (重复上传会多计，下次覆盖时纠正；多计只会多发请求，不会漏数据)
+# 连续时段只做并集，不会因为覆盖而缩小。
+# 侧栏用它列出可选序列和估计行数，抓取引擎用它跳过整天没有数据的日子、按实际行数切分片。
+
+
+def _empty(cols, extra):
+    return pd.DataFrame({**{c: pd.Series(dtype=str) for c in cols},
+                         **{c: pd.Series(dtype=dtype) for c, dtype in extra.items()}})
+
+
+def _as_str(col):
+    # 分类列 (抓取引擎解码出来的) 先转换类别再按编码取，比逐行 astype 快得多
+    if isinstance(col.dtype, pd.CategoricalDtype) and not (col.cat.codes < 0).any():
+        return pd.Series(col.cat.categories.astype(str).take(col.cat.codes.to_numpy()), index=col.index)
+    return col.astype(str)
+
+
+def _tuples(index):
+    return [key if isinstance(key, tuple) else (key,) for key in index]
+
+
+DAILY = {'day': 'datetime64[ns]', 'rows': 'int64', 'first': 'datetime64[ns]', 'last': 'datetime64[ns]'}
+RUNS = {'start': 'datetime64[ns]', 'end': 'datetime64[ns]'}
+
+
+class Catalog:
+    """一张表的可用性目录，存放在 <root>/<name>/_catalog"""
+
+    def __init__(self, root, name, time_col='timestamp', key_cols=(), dim_cols=(),
+                 gap=timedelta(hours=1), lookback=timedelta(days=1)):
+        self.dir = os.path.join(root, name, "_catalog")
+        self.time_col = time_col
+        self.key_cols = list(key_cols)
+        self.cols = self.key_cols + list(dim_cols)
+        self.gap = pd.Timedelta(gap)
+        self.lookback = pd.Timedelta(lookback)
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()   # 同一时刻只有一次扫描；扫描期间不挡读取
+        self.version = 0            # 每次修改加一，概况表按它记忆 (侧栏每次重跑都要显示)
+        self._summary = None
+        os.makedirs(self.dir, exist_ok=True)
+        self.daily = self._read("daily", DAILY)
+        self.runs = self._read("runs", RUNS)
+        try:
+            with open(os.path.join(self.dir, "_state.json"), "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.through = pd.Timestamp(state["through"]) if state.get("through") else None
+            self.refreshed = state.get("refreshed")
+        except (OSError, ValueError, KeyError):
+            self.through, self.refreshed = None, None
+
+    # ---------- 存储 ----------
+    def _read(self, name, extra):
+        path = os.path.join(self.dir, f"{name}.parquet")
+        if os.path.exists(path):
+            try:
+                return pd.read_parquet(path)
+            except (OSError, ValueError):
+                pass
+        return _empty(self.cols, extra)
+
+    def _save(self):
+        self.version += 1
+        for name, df in (("daily", self.daily), ("runs", self.runs)):
+            path = os.path.join(self.dir, f"{name}.parquet")
+            df.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+        state = {"through": self.through.isoformat() if self.through is not None else None, "refreshed": self.refreshed}
+        tmp = os.path.join(self.dir, "_state.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(self.dir, "_state.json"))
+
+    def clear(self):
+        """清空目录，下次 refresh 重新整表扫描 (正在进行的扫描先做完，免得它把 through 写回去)"""
+        with self._refresh_lock, self._lock:
+            self.daily = _empty(self.cols, DAILY)
+            self.runs = _empty(self.cols, RUNS)
+            self.through, self.refreshed = None, None
+            self._save()
+
+    # ---------- 从原始行统计 ----------
+    def _prepare(self, rows):
+        df = rows[self.cols + [self.time_col]].dropna(subset=[self.time_col])
+        return df.assign(**{c: _as_str(df[c]) for c in self.cols})
+
+    def _day_stats(self, df):
+        t = df[self.time_col]
+        g = df.assign(day=t.dt.normalize()).groupby(self.cols + ['day'], sort=False)[self.time_col]
+        return g.agg(rows='size', first='min', last='max').reset_index()
+
+    def _run_stats(self, df):
+        # 按序列、时间排序后，序列切换或间隔超过 gap 的位置开始一个新时段
+        df = df.sort_values(self.cols + [self.time_col], kind='stable')
+        t = df[self.time_col].to_numpy(dtype='datetime64[ns]')
+        new = np.ones(len(df), dtype=bool)
+        new[1:] = np.diff(t.view(np.int64)) > self.gap.value
+        for col in self.cols:
+            v = df[col].to_numpy()
+            new[1:] |= v[1:] != v[:-1]
+        starts = np.flatnonzero(new)
+        ends = np.append(starts[1:], len(df)) - 1
+        runs = df.iloc[starts][self.cols].reset_index(drop=True)
+        runs['start'], runs['end'] = t[starts], t[ends]
+        return runs
+
+    def _union_runs(self, new):
+        # 相同序列的时段合并：开始时刻不晚于前面时段的最晚结束 + gap 即视为同一段
+        runs = pd.concat([df for df in (self.runs, new) if not df.empty] or [self.runs], ignore_index=True)
+        if runs.empty:
+            return runs
+        runs = runs.sort_values(self.cols + ['start'], kind='stable').reset_index(drop=True)
+        reach = runs.groupby(self.cols, sort=False)['end'].cummax() if self.cols else runs['end'].cummax()
+        reach = reach.to_numpy(dtype='datetime64[ns]')
+        start = runs['start'].to_numpy(dtype='datetime64[ns]')
+        new_run = np.ones(len(runs), dtype=bool)
+        new_run[1:] = start[1:] > reach[:-1] + self.gap.to_timedelta64()
+        for col in self.cols:
+            v = runs[col].to_numpy()
+            new_run[1:] |= v[1:] != v[:-1]
+        run_id = np.cumsum(new_run)
+        agg = runs.groupby(run_id, sort=False).agg(**{c: (c, 'first') for c in self.cols},
+                                                     start=('start', 'min'), end=('end', 'max'))
+        return agg.reset_index(drop=True)
+
+    def _replace_days(self, stats, days, series=None):
+        # 覆盖 days 内 (series 给定时只覆盖这些序列) 的每日计数
+        daily = self.daily
+        mask = daily['day'].isin(pd.DatetimeIndex(days))
+        if series is not None and self.key_cols:
+            keys = pd.MultiIndex.from_frame(daily[self.key_cols])
+            mask &= keys.isin(list(series))
+        frames = [df for df in (daily[~mask], stats) if not df.empty]
+        self.daily = pd.concat(frames, ignore_index=True) if frames else daily.iloc[0:0]
+
+    def add_rows(self, rows):
+        """上传后调用：把这些行累加进目录"""
+        if rows is None or rows.empty:
+            return
+        df = self._prepare(rows)
+        with self._lock:
+            merged = pd.concat([self.daily, self._day_stats(df)], ignore_index=True)
+            self.daily = merged.groupby(self.cols + ['day'], sort=False) \
+                .agg(rows=('rows', 'sum'), first=('first', 'min'), last=('last', 'max')).reset_index()
+            self.runs = self._union_runs(self._run_stats(df))
+            self._save()
+
+    def replace_days(self, rows, days, series=None):
+        """rows 是这些天 (series 给定时为这些序列) 的全部数据：覆盖计数，并入连续时段"""
+        df = self._prepare(rows)
+        with self._lock:
+            self._replace_days(self._day_stats(df), days, series)
+            if not df.empty:
+                self.runs = self._union_runs(self._run_stats(df))
+            self._save()
+
+    def refresh(self, fetch, start=None, now=None):
+        """增量扫描数据库：fetch(lo, hi) 返回 (lo, hi] 内各行的主键列与时间列。
+        从未扫描过时从 start 开始 (None 表示表为空)；返回扫描的行数。
+        访问数据库时不持有目录锁，可以放在后台线程里跑"""
+        now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+        with self._refresh_lock:
+            with self._lock:
+                through = self.through
+            if through is not None:
+                start = (through - self.lookback).normalize() - ONE_US
+            elif start is not None:
+                start = pd.Timestamp(start).normalize() - ONE_US
+            df = None
+            if start is not None and start < now:
+                df = fetch(start.to_pydatetime(), now.to_pydatetime())
+            if df is not None:
+                days = pd.date_range(start + ONE_US, now.normalize(), freq='D')
+                self.replace_days(df if len(df) else _empty(self.cols, {self.time_col: 'datetime64[ns]'}), days)
+            with self._lock:
+                self.through, self.refreshed = now, time.time()
+                self._save()
+            return 0 if df is None else len(df)
+
+    def on_cache_change(self, cache):
+        """返回挂到 PartitionedCache.subscribe 上的回调：某天完整缓存的序列用分区数据覆盖计数。
+        用缓存刚写好的分区行统计，只有没写入新行的天才读文件；一次写入涉及的所有天合并成一次更新、一次落盘"""
+        def callback(event, days, parts):
+            if event != 'commit':
+                return
+            updates, frames = [], []
+            for day in days:
+                scopes = cache.complete_scopes(day)
+                if not scopes:
+                    continue
+                rows = parts.get(day)
+                if rows is None:
+                    rows = cache.load(*day_bounds(day), columns=self.cols + [self.time_col])
+                series = None if "*" in scopes else {tuple(scope.split("|")) for scope in scopes}
+                if series is not None and not rows.empty:
+                    rows = rows[pd.MultiIndex.from_frame(rows[self.key_cols].astype(str)).isin(list(series))]
+                updates.append((pd.Timestamp(day), series))
+                if not rows.empty:
+                    frames.append(self._prepare(rows))
+            if not updates:
+                return
+            df = pd.concat(frames, ignore_index=True) if frames else None
+            stats = self._day_stats(df) if df is not None else self.daily.iloc[0:0]
+            with self._lock:
+                for day, series in updates:
+                    self._replace_days(stats[stats['day'] == day], [day], series)
+                if df is not None:
+                    self.runs = self._union_runs(self._run_stats(df))
+                self._save()
+        return callback
+
+    def stale_days(self, cache):
+        """本地缓存里已完整、但行数与目录对不上的日期 (别的写入方绕过本应用改过这些天)。
+        重建目录之后用它让这些天的缓存失效"""
+        with self._lock:
+            daily = self.daily
+        by = ['day'] + self.key_cols
+        counts = daily[daily['rows'] > 0].groupby(by)['rows'].sum()
+        expected = {}
+        for key, n in zip(_tuples(counts.index), counts.to_numpy()):
+            expected.setdefault(key[0], {})[key] = n
+        stale = []
+        for day in cache.cached_days():
+            scopes = cache.complete_scopes(day)
+            if not scopes:
+                continue
+            d_lo, d_hi = day_bounds(day)
+            rows = cache.load(d_lo, d_hi, columns=self.key_cols + [self.time_col])
+            found = {}
+            if not rows.empty:
+                counts = rows.astype({c: str for c in self.key_cols}).assign(day=pd.Timestamp(day)).groupby(by).size()
+                found = dict(zip(_tuples(counts.index), counts.to_numpy()))
+            want = expected.get(pd.Timestamp(day), {})
+            if "*" not in scopes:
+                keep = {(pd.Timestamp(day),) + tuple(scope.split("|")) for scope in scopes}
+                found = {k: n for k, n in found.items() if k in keep}
+                want = {k: n for k, n in want.items() if k in keep}
+            if found != want:
+                stale.append(day)
+        return stale
+
+    # ---------- 查询 ----------
+    def _by_series(self, df):
+        # 没有主键的表 (降雨) 整表算一个序列
+        return df.groupby(self.cols, sort=True) if self.cols else df.groupby(np.zeros(len(df), dtype=int))
+
+    def _flat(self, out):
+        return out.reset_index() if self.cols else out.reset_index(drop=True)
+
+    def _filter(self, df, filters):
+        for col, values in (filters or {}).items():
+            df = df[df[col].isin([str(v) for v in values])]
+        return df
+
+    def _overlap_rows(self, daily, start, end):
+        # 每天的行数按 (start, end] 与当天首末时刻的重叠比例折算
+        first = daily['first'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        last = daily['last'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        a, b = pd.Timestamp(start).value, pd.Timestamp(end).value
+        width = last - first
+        overlap = np.clip(np.minimum(last, b) - np.maximum(first, a), 0, None)
+        inside = (first > a) & (first <= b)
+        frac = np.where(width > 0, overlap / np.maximum(width, 1), inside.astype(float))
+        return daily['rows'].to_numpy() * frac, (first <= b) & (last > a)
+
+    def series(self, start, end):
+        """(start, end] 内有数据的序列：主键列 + 附属列 + rows (估计行数) / first / last"""
+        with self._lock:
+            daily = self.daily
+        rows, hit = self._overlap_rows(daily, start, end)
+        daily = daily.assign(rows=rows)[hit]
+        if daily.empty:
+            return _empty(self.cols, {'rows': 'int64', 'first': 'datetime64[ns]', 'last': 'datetime64[ns]'})
+        out = self._by_series(daily).agg(rows=('rows', 'sum'), first=('first', 'min'), last=('last', 'max'))
+        return self._flat(out.assign(rows=out['rows'].round().astype('int64')))
+
+    def estimate(self, start, end, filters=None):
+        """(start, end] 内的估计行数 (filters 同抓取引擎：{列名: 取值列表})"""
+        with self._lock:
+            daily = self._filter(self.daily, filters)
+        return int(round(self._overlap_rows(daily, start, end)[0].sum()))
+
+    def summary(self):
+        """每个序列的首末时刻、总行数、有数据的天数和缺测次数"""
+        with self._lock:
+            daily, runs, version = self.daily, self.runs, self.version
+            if self._summary is not None and self._summary[0] == version:
+                return self._summary[1]
+        out = self._summarize(daily, runs)
+        with self._lock:
+            self._summary = (version, out)
+        return out
+
+    def _summarize(self, daily, runs):
+        if daily.empty:
+            return _empty(self.cols, {'first': 'datetime64[ns]', 'last': 'datetime64[ns]', 'rows': 'int64',
+                                      'days': 'int64', 'gaps': 'int64'})
+        out = self._by_series(daily).agg(first=('first', 'min'), last=('last', 'max'),
+                                         rows=('rows', 'sum'), days=('day', 'nunique'))
+        n_runs = self._by_series(runs).size()
+        out['gaps'] = (n_runs.reindex(out.index).fillna(1).astype('int64') - 1).clip(lower=0).to_numpy()
+        return self._flat(out)
+
+    def gaps(self, key=None):
+        """某个序列 (key 为主键元组，无主键的表为 None) 的缺测区间 [(开始, 结束)]"""
+        with self._lock:
+            runs = self.runs
+        if key is not None:
+            runs = self._filter(runs, {col: [v] for col, v in zip(self.key_cols, key)})
+        runs = runs.sort_values('start')
+        return list(zip(runs['end'].iloc[:-1], runs['start'].iloc[1:]))
+
+    def windows(self, lo, hi, filters=None):
+        """(lo, hi] 中可能有数据的子区间 [(lo, hi, 估计行数)]，按整天取舍：
+        through 那天之前目录是完整的，只保留有数据的日子，相邻的日子连成一段；
+        through 那天起目录未知，整段保留，行数为 None。抓取引擎再按分片数合并过碎的区间"""
+        lo, hi = pd.Timestamp(lo), pd.Timestamp(hi)
+        with self._lock:
+            through, daily = self.through, self._filter(self.daily, filters)
+        if through is None:
+            return [(lo.to_pydatetime(), hi.to_pydatetime(), None)]
+        # through 那天只扫描了一部分，从那天零点起都算未知
+        known_hi = min(hi, max(lo, day_bounds(through.normalize())[0]))
+        out = []
+        if lo < known_hi and not daily.empty:
+            rows, hit = self._overlap_rows(daily, lo, known_hi)
+            hit &= daily['rows'].to_numpy() > 0
+            per_day = pd.Series(rows[hit], index=daily['day'][hit].to_numpy()).groupby(level=0).sum()
+            for day, n in per_day.items():
+                a, b = day_bounds(day)
+                a, b = max(a, lo), min(b, known_hi)
+                if out and a <= out[-1][1]:
+                    out[-1][1], out[-1][2] = b, out[-1][2] + n
+                elif a < b:
+                    out.append([a, b, n])
+        out = [(a.to_pydatetime(), b.to_pydatetime(), int(round(n))) for a, b, n in out]
+        if hi > known_hi:
+            out.append((known_hi.to_pydatetime(), hi.to_pydatetime(), None))
+        return out
@@ -0,0 +1,159 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ================= 批量清洗 =================
+# 去尖峰 (滚动中值 + 阈值替换) 与平滑 (滚动均值) 一次作用在多条序列拼接成的连续数组上：
+#   - 滚动中值用 scipy.ndimage 的秩滤波 (C 实现) 对整段数组一次算完，
+#     只有各序列首尾半个窗口内会跨序列、窗口被截断的点，再用带 NaN 填充的窗口矩阵单独补算
+#   - 滚动均值用前缀和，窗口在序列边界处截断
+# 窗口语义与 pandas rolling(window, center=True, min_periods=1) 一致：
+# 第 i 个点的窗口为 [i - w//2, i + (w-1)//2]，超出序列的部分不计入。
+# 阈值默认是与局部中值的绝对偏差；mad=True 时按 Hampel 滤波解释为 MAD 的倍数。
+
+MAD_SCALE = 1.4826      # 正态分布下 MAD 与标准差的换算系数
+MIN_DESPIKE_WINDOW = 5  # 即便不做平滑，检测窗口也不能太小
+
+
+def _bounds(lengths):
+    """每个点所在序列的 [起点, 终点) (拼接后的全局下标)"""
+    stops = np.cumsum(lengths)
+    starts = stops - lengths
+    return np.repeat(starts, lengths), np.repeat(stops, lengths)
+
+
+def _edge_positions(lengths, window):
+    """各序列首尾窗口会被截断 (或跨到相邻序列) 的点"""
+    left, right = window // 2, (window - 1) // 2
+    stops = np.cumsum(lengths)
+    starts = stops - lengths
+    pos = [np.arange(a, min(a + left, b)) for a, b in zip(starts, stops)]
+    pos += [np.arange(max(b - right, a), b) for a, b in zip(starts, stops)]
+    return np.unique(np.concatenate(pos)) if pos else np.empty(0, dtype=np.int64)
+
+
+def rolling_median(x, lengths, window):
+    """对拼接数组按序列分别做居中滚动中值"""
+    from scipy.ndimage import median_filter, rank_filter
+
+    x = np.asarray(x, dtype=np.float64)
+    if window <= 1 or len(x) == 0:
+        return x.copy()
+    if window % 2:
+        out = median_filter(x, size=window, mode='nearest')
+    else:
+        # 偶数窗口取中间两个数的均值 (与 pandas 一致)
+        out = 0.5 * (rank_filter(x, window // 2 - 1, size=window, mode='nearest')
+                     + rank_filter(x, window // 2, size=window, mode='nearest'))
+    # 序列首尾：用 NaN 填充窗口外的位置后按行取中值
+    edge = _edge_positions(lengths, window)
+    if len(edge):
+        lo, hi = _bounds(lengths)
+        offsets = np.arange(-(window // 2), (window - 1) // 2 + 1)
+        idx = edge[:, None] + offsets[None, :]
+        inside = (idx >= lo[edge][:, None]) & (idx < hi[edge][:, None])
+        windows = np.where(inside, x[np.clip(idx, 0, len(x) - 1)], np.nan)
+        out[edge] = np.nanmedian(windows, axis=1)
+    return out
+
+
+def rolling_mean(x, lengths, window):
+    """对拼接数组按序列分别做居中滚动均值 (前缀和)"""
+    x = np.asarray(x, dtype=np.float64)
+    if window <= 1 or len(x) == 0:
+        return x.copy()
+    lo, hi = _bounds(lengths)
+    i = np.arange(len(x))
+    a = np.maximum(i - window // 2, lo)
+    b = np.minimum(i + (window - 1) // 2 + 1, hi)
+    cs = np.r_[0.0, np.cumsum(x)]
+    return (cs[b] - cs[a]) / (b - a)
+
+
+def clean_batch(arrays, window_size, spike_threshold, mad=False):
+    """批量清洗多条序列，返回与输入一一对应的 float64 数组"""
+    arrays = [np.asarray(a, dtype=np.float64) for a in arrays]
+    if not arrays:
+        return []
+    lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+    x = np.concatenate(arrays)
+    if not np.isfinite(x).all():
+        # 含缺测值时滚动窗口的有效点数各不相同，逐条交给 pandas 处理
+        return [_clean_pandas(a, window_size, spike_threshold, mad) for a in arrays]
+
+    # 1. 去尖峰：偏差超过阈值的点替换为局部中值，曲线保持连贯
+    if spike_threshold > 0:
+        despike_window = max(MIN_DESPIKE_WINDOW, window_size)
+        median = rolling_median(x, lengths, despike_window)
+        deviation = np.abs(x - median)
+        if mad:
+            limit = spike_threshold * MAD_SCALE * rolling_median(deviation, lengths, despike_window)
+        else:
+            limit = spike_threshold
+        x = np.where(deviation > limit, median, x)
+
+    # 2. 平滑：移动平均
+    if window_size > 1:
+        x = rolling_mean(x, lengths, window_size)
+    return np.split(x, np.cumsum(lengths)[:-1])
+
+
+def _clean_pandas(values, window_size, spike_threshold, mad=False):
+    import pandas as pd
+
+    series = pd.Series(values, dtype=np.float64, copy=True)
+    if spike_threshold > 0:
+        despike_window = max(MIN_DESPIKE_WINDOW, window_size)
+        rolling_median = series.rolling(window=despike_window, center=True, min_periods=1).median()
+        deviation = (series - rolling_median).abs()
+        limit = spike_threshold
+        if mad:
+            limit = spike_threshold * MAD_SCALE * deviation.rolling(window=despike_window, center=True, min_periods=1).median()
+        outliers = deviation > limit
+        if outliers.any():
+            series.loc[outliers] = rolling_median.loc[outliers]
+    if window_size > 1:
+        series = series.rolling(window=window_size, min_periods=1, center=True).mean()
+    return series.to_numpy(dtype=np.float64)
+
+
+class CleaningEngine:
+    """按 (序列版本, 窗口, 阈值, 模式) 记忆清洗结果；未命中的序列合成一批一起算"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clean(self, items, window_size, spike_threshold, mad=False):
+        """items: [(版本, 数值数组)]，返回清洗后的数组列表 (只读，勿修改)"""
+        params = (window_size, float(spike_threshold), bool(mad))
+        out, todo = [None] * len(items), []
+        with self._lock:
+            for i, (version, _) in enumerate(items):
+                hit = self._items.get((version, params))
+                if hit is not None:
+                    self._items.move_to_end((version, params))
+                    out[i] = hit
+                else:
+                    todo.append(i)
+        if todo:
+            cleaned = clean_batch([items[i][1] for i in todo], window_size, spike_threshold, mad)
+            with self._lock:
+                for i, arr in zip(todo, cleaned):
+                    arr.flags.writeable = False
+                    out[i] = arr
+                    self._put((items[i][0], params), arr)
+        return out
+
+    def _put(self, key, arr):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self._items[key] = arr
+        self.nbytes += arr.nbytes
+        while self.nbytes > self.max_bytes and len(self._items) > 1:
+            _, dropped = self._items.popitem(last=False)
+            self.nbytes -= dropped.nbytes
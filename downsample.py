@@ -0,0 +1,107 @@
+import numpy as np
+
+# ================= 按像素降采样 =================
+# 渲染开销只跟像素有关：一条曲线在 W 像素宽的坐标轴上，最多只需要 W 个桶。
+#   minmax: 每个时间桶保留最小值和最大值 (按原时间顺序)，尖峰一个不丢
+#   lttb:   Largest-Triangle-Three-Buckets，每个桶保留一个最能代表形状的点
+# 输入 x 必须单调不减 (时间戳可以是 datetime64，会按 int64 处理)
+
+
+def point_budget(figsize, dpi, axes_fraction=0.8):
+    """由画布宽度和 DPI 估算坐标轴内的像素列数，作为每条曲线的桶数"""
+    return max(2, int(figsize[0] * dpi * axes_fraction))
+
+
+def _as_float(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def _time_buckets(xf, n_buckets):
+    """按时间等宽分桶，返回每个点所在的桶号 (与像素列一一对应)"""
+    span = xf[-1] - xf[0]
+    if span <= 0:
+        return np.zeros(len(xf), dtype=np.int64)
+    idx = ((xf - xf[0]) * (n_buckets / span)).astype(np.int64)
+    return np.minimum(idx, n_buckets - 1)
+
+
+def minmax_indices(x, y, n_buckets):
+    """每个时间桶的最小值、最大值所在下标 (升序去重)"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    finite = np.isfinite(y)
+    bucket = _time_buckets(_as_float(x), n_buckets)
+    # 每个桶的起始位置 (x 有序，所以桶号也有序)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    lo = np.where(finite, y, np.inf)
+    hi = np.where(finite, y, -np.inf)
+    bmin = np.minimum.reduceat(lo, starts)
+    bmax = np.maximum.reduceat(hi, starts)
+    counts = np.diff(np.r_[starts, n])
+    seg = np.repeat(np.arange(len(starts)), counts)
+    # 取每个桶中第一个等于极值的位置
+    is_min = np.flatnonzero(lo == np.repeat(bmin, counts))
+    is_max = np.flatnonzero(hi == np.repeat(bmax, counts))
+    _, first_min = np.unique(seg[is_min], return_index=True)
+    _, first_max = np.unique(seg[is_max], return_index=True)
+    keep = np.concatenate([is_min[first_min], is_max[first_max], [0, n - 1]])
+    keep = np.unique(keep)
+    return keep[finite[keep]]
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets 选点下标。
+    标准 LTTB 的 A 点是上一个桶选中的点，逐桶依赖无法向量化；
+    这里用上一个桶的均值点代替，所有桶一次算完，形状上与标准版几乎一致。"""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    xf = _as_float(x)
+    finite = np.isfinite(y)
+    if not finite.all():
+        keep = np.flatnonzero(finite)
+        return keep[lttb_indices(xf[keep], y[keep], n_out)]
+    # 首尾两点固定，中间 n_out-2 个桶按点数等分
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+    width = counts.max()
+    # 每个桶的下标矩阵 (不足的位置用桶内最后一个点填充)
+    cols = np.arange(width)
+    idx = starts[:, None] + np.minimum(cols[None, :], (counts - 1)[:, None])
+    # 各桶均值点 (首尾点单独作为一个桶)
+    cx = np.add.reduceat(xf[1:n - 1], starts - 1) / counts
+    cy = np.add.reduceat(y[1:n - 1], starts - 1) / counts
+    ax = np.r_[xf[0], cx[:-1]]
+    ay = np.r_[y[0], cy[:-1]]
+    nx = np.r_[cx[1:], xf[n - 1]]
+    ny = np.r_[cy[1:], y[n - 1]]
+    px, py = xf[idx], y[idx]
+    area = np.abs((ax[:, None] - nx[:, None]) * (py - ay[:, None]) - (ax[:, None] - px) * (ny[:, None] - ay[:, None]))
+    picked = idx[np.arange(len(starts)), area.argmax(axis=1)]
+    return np.r_[0, picked, n - 1]
+
+
+def downsample_indices(x, y, n_buckets, mode='minmax'):
+    """两种模式都最多保留 2 * n_buckets 个点，返回保留点的下标"""
+    if mode == 'lttb':
+        return lttb_indices(x, y, 2 * n_buckets)
+    if mode == 'minmax':
+        return minmax_indices(x, y, n_buckets)
+    raise ValueError(f"未知的降采样模式: {mode}")
+
+
+def downsample(x, y, n_buckets, mode='minmax'):
+    """返回降采样后的 (x, y)；点数本来就少时原样返回"""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    keep = downsample_indices(x, y, n_buckets, mode)
+    if len(keep) == len(y):
+        return x, y
+    return x[keep], y[keep]
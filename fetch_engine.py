@@ -0,0 +1,181 @@
+import contextvars
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+from instrument import enabled as tracing, span
+from wire import column_types, decode_csv, decode_json, tail_run, to_frame
+
+# ================= 并发分片拉取引擎 =================
+# 1. 按估计行数把 (lo, hi] 切成若干时间分片
+# 2. 线程池并发拉取各分片，分片内部按 (时间, 主键) 做游标分页
+# 3. 按分片顺序拼接，分片之间左开右闭互不重叠
+#
+# 分片内的翻页不再用 .gt(上一页最后时间)，那样会丢掉与页边界同一时刻的其余行。
+# 改为 .gte(边界时间) 并跳过已经读过的同一时刻的行数 (offset)，
+# 排序带上主键列保证顺序唯一，所以跳过的行数是确定的。
+#
+# 每页按 CSV 请求并直接解码成列 (见 wire.py)，客户端不支持 .csv() 时退回 JSON。
+# 给了可用性目录 (catalog.py) 时，整天没有数据的日子不发请求，分片按目录里的行数切分，不再请求 planned count；
+# 分片总数不超过不用目录时的规划。
+
+
+class ShardedFetcher:
+    """按时间分片并发拉取一张表的 (lo, hi] 区间"""
+
+    def __init__(self, client, table, columns, time_col='timestamp', order_cols=(), numeric=(),
+                 page_size=20000, max_workers=4, max_shards=64, wire='csv', catalog=None, not_null=()):
+        self.client = client
+        self.table = table
+        self.columns = columns
+        self.time_col = time_col
+        self.types = column_types([c.strip() for c in columns.split(',')], time_col, numeric)
+        self.wire = wire
+        self.catalog = catalog
+        self.order_cols = list(order_cols)
+        self.not_null = list(not_null)
+        self.page_size = page_size
+        self.max_workers = max(1, int(max_workers))
+        self.max_shards = max_shards
+
+    def _apply_filters(self, q, filters):
+        # 过滤条件下推到数据库: {列名: 取值列表} -> column=in.(...)；not_null 中的列 -> column=not.is.null
+        for col, values in (filters or {}).items():
+            q = q.in_(col, list(values))
+        for col in self.not_null:
+            q = q.not_.is_(col, "null")
+        return q
+
+    # ---------- 分片规划 ----------
+    def estimate_rows(self, lo, hi, filters=None):
+        """用 PostgREST 的 planned count 估计区间行数 (只读执行计划，开销很小)；失败返回 None"""
+        try:
+            q = self.client.table(self.table) \
+                .select(self.time_col, count="planned") \
+                .gt(self.time_col, lo.isoformat()) \
+                .lte(self.time_col, hi.isoformat())
+            return self._apply_filters(q, filters).limit(1).execute().count
+        except Exception:
+            return None
+
+    def shard_count(self, est_rows):
+        if est_rows is None:
+            # 估不出来就按并发数平分，至少不比串行慢
+            n = self.max_workers
+        else:
+            # 每个分片约两页，分片数多于并发数时线程池自然排队
+            n = math.ceil(est_rows / (self.page_size * 2))
+        return max(1, min(n, self.max_shards))
+
+    @staticmethod
+    def split(lo, hi, n):
+        """(lo, hi] 按时间等分成 n 个首尾相接的分片"""
+        edges = pd.date_range(pd.Timestamp(lo), pd.Timestamp(hi), periods=n + 1)
+        # 取整到微秒，首尾保持原值，保证分片首尾相接
+        edges = [pd.Timestamp(lo)] + [e.floor('us') for e in edges[1:-1]] + [pd.Timestamp(hi)]
+        return [(edges[i].to_pydatetime(), edges[i + 1].to_pydatetime()) for i in range(n) if edges[i] < edges[i + 1]]
+
+    def plan_shards(self, lo, hi, est_rows=None, filters=None):
+        if est_rows is None:
+            est_rows = self.estimate_rows(lo, hi, filters)
+        return self.split(lo, hi, self.shard_count(est_rows))
+
+    def plan_catalog_shards(self, lo, hi, filters=None):
+        """按可用性目录规划：跳过整天没有数据的日子，但总分片数不超过不用目录时的规划
+        (零散的记录不会变成一条一个请求)。目录未知的部分仍用 planned count 估计"""
+        windows = [(a, b, self.estimate_rows(a, b, filters) if n is None else n)
+                   for a, b, n in self.catalog.windows(lo, hi, filters)]
+        if not windows:
+            return []
+        counts = [n for _, _, n in windows]
+        n_shards = self.shard_count(None if None in counts else sum(counts))
+        if len(windows) > n_shards:
+            # 只跳过最长的 n_shards - 1 个空档，其余空档连同两侧并成一段
+            gaps = sorted(range(len(windows) - 1), key=lambda i: windows[i + 1][0] - windows[i][1], reverse=True)
+            merged, first = [], 0
+            for last in sorted(gaps[:n_shards - 1]) + [len(windows) - 1]:
+                part = windows[first:last + 1]
+                rows = [n for _, _, n in part]
+                merged.append((part[0][0], part[-1][1], None if None in rows else sum(rows)))
+                first = last + 1
+            windows = merged
+        # 每段至少一个分片，其余分片按行数 (行数未知时按时长) 分配
+        weights = [n if None not in counts else (b - a).total_seconds() for a, b, n in windows]
+        total, spare = sum(weights) or 1, n_shards - len(windows)
+        return [s for (a, b, _), w in zip(windows, weights) for s in self.split(a, b, 1 + int(spare * w / total))]
+
+    # ---------- 单个分片 ----------
+    def _query(self, hi, filters):
+        q = self.client.table(self.table).select(self.columns).lte(self.time_col, hi.isoformat())
+        q = self._apply_filters(q, filters)
+        for col in [self.time_col] + self.order_cols:
+            q = q.order(col)
+        return q
+
+    def _page(self, q):
+        # 一页 -> pyarrow.Table 以及响应体字节数 (只在诊断打开时计算)
+        if self.wire == 'csv' and hasattr(q, 'csv'):
+            text = q.csv().execute().data
+            return decode_csv(text, self.types), len(text) if text else 0
+        page = q.execute().data
+        size = len(json.dumps(page, default=str)) if tracing() else None
+        return decode_json(page, self.types), size
+
+    def fetch_shard(self, lo, hi, filters=None):
+        tables = []
+        cursor, skip = None, 0
+        while True:
+            q = self._query(hi, filters)
+            if cursor is None:
+                q = q.gt(self.time_col, lo.isoformat())
+            else:
+                q = q.gte(self.time_col, cursor)
+            with span("fetch.page", table=self.table) as sp:
+                page, size = self._page(q.range(skip, skip + self.page_size - 1))
+                sp.set(rows=page.num_rows, bytes=size)
+            if not page.num_rows:
+                break
+            tables.append(page)
+            if page.num_rows < self.page_size:
+                break
+            # 下一页从最后一个时刻重新开始，跳过这个时刻已经读过的行
+            last, same = tail_run(page, self.time_col)
+            skip = skip + same if last == cursor else same
+            cursor = last
+        return tables
+
+    # ---------- 并发拉取 ----------
+    def plan(self, lo, hi, filters=None, est_rows=None):
+        """要拉取的分片 [(lo, hi)]；有目录时只含可能有数据的部分，没有列出的时段不会被读取"""
+        if self.catalog is not None and est_rows is None:
+            return self.plan_catalog_shards(lo, hi, filters)
+        return self.plan_shards(lo, hi, est_rows, filters)
+
+    def fetch(self, lo, hi, filters=None, progress=None, est_rows=None, shards=None):
+        """返回 (lo, hi] 内全部行 (DataFrame，按时间有序)；progress(rows, done, total) 在调用线程回调。
+        shards 为 plan() 的结果 (调用方需要知道实际读了哪些时段时先规划再传入)"""
+        if shards is None:
+            shards = self.plan(lo, hi, filters, est_rows)
+        if not shards:
+            return pd.DataFrame()
+        results = [None] * len(shards)
+        loaded = 0
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(shards))) as pool:
+            # 每个任务带上调用方的上下文，分页计时记到发起请求的会话上
+            futures = {pool.submit(contextvars.copy_context().run, self.fetch_shard, a, b, filters): i
+                       for i, (a, b) in enumerate(shards)}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    tables = future.result()
+                except Exception:
+                    # 一个分片失败就放弃整个区间，尚未开始的分片直接取消
+                    for f in futures: f.cancel()
+                    raise
+                results[futures[future]] = tables
+                loaded += sum(t.num_rows for t in tables)
+                if progress:
+                    progress(loaded, done, len(shards))
+        with span("fetch.decode", table=self.table, rows=loaded):
+            return to_frame([t for tables in results for t in tables], self.types)
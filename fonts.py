@@ -0,0 +1,74 @@
+import glob
+import json
+import os
+
+# ================= 中文字体 =================
+# 启动时不访问网络，也不导入 matplotlib：
+# 1. 先找给定的本地字体文件 (例如放在仓库目录里的 SimHei.ttf)
+# 2. 再从 matplotlib 预先生成的字体缓存 (fontlist-*.json) 里按名称挑一个中文字体
+# 3. 缓存还没生成时，直接在系统字体目录里找常见的中文字体文件
+# 中文字体由 packages.txt 里的 fonts-noto-cjk 提供 (容器 / Streamlit Cloud 部署时安装)，
+# 字体缓存在构建镜像 / 容器时生成一次：python fonts.py
+
+CJK_FAMILIES = [
+    "SimHei", "Noto Sans CJK SC", "Noto Sans SC", "Source Han Sans SC", "WenQuanYi Zen Hei",
+    "WenQuanYi Micro Hei", "Microsoft YaHei", "PingFang SC", "Heiti SC", "AR PL UMing CN",
+    # fonts-noto-cjk 的 .ttc 在 matplotlib 里登记为第一个字形集的名字，同样包含全部汉字
+    "Noto Sans CJK JP",
+]
+SYSTEM_FONT_GLOBS = [
+    "/usr/share/fonts/**/NotoSansCJK-Regular.ttc", "/usr/share/fonts/**/NotoSansCJK*-Regular.*",
+    "/usr/share/fonts/**/wqy-zenhei.ttc", "/usr/share/fonts/**/wqy-microhei.ttc",
+]
+
+
+def cache_dirs():
+    """matplotlib 可能使用的缓存目录 (与 matplotlib.get_cachedir() 的查找顺序一致)"""
+    if os.environ.get("MPLCONFIGDIR"):
+        return [os.environ["MPLCONFIGDIR"]]
+    xdg = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return [os.path.join(xdg, "matplotlib"), os.path.join(os.path.expanduser("~"), ".matplotlib")]
+
+
+def cached_fonts(dirs=None):
+    """字体缓存里的 [(字体名, 文件路径)]；没有缓存时返回空列表"""
+    for d in dirs or cache_dirs():
+        # 多个版本的缓存并存时取文件名最大的 (版本最新)
+        for path in sorted(glob.glob(os.path.join(d, "fontlist-*.json")), reverse=True):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            return [(entry.get("name"), entry.get("fname")) for entry in data.get("ttflist", [])]
+    return []
+
+
+def find_cjk_font(local_paths=(), families=CJK_FAMILIES, dirs=None, system_globs=SYSTEM_FONT_GLOBS):
+    """中文字体文件的路径，找不到时返回 None (图中的中文会显示为方框，但不影响绘图，调用方应提示)"""
+    for path in local_paths:
+        if path and os.path.isfile(path):
+            return os.path.abspath(path)
+    found = {}
+    for name, fname in cached_fonts(dirs):
+        if name and fname and name not in found and os.path.isfile(fname):
+            found[name] = fname
+    path = next((found[name] for name in families if name in found), None)
+    if path:
+        return path
+    for pattern in system_globs:
+        hits = sorted(glob.glob(pattern, recursive=True))
+        if hits:
+            return hits[0]
+    return None
+
+
+def build_font_cache():
+    """让 matplotlib 扫描系统字体并写入缓存 (导入 font_manager 时自动完成)，返回找到的中文字体"""
+    import matplotlib.font_manager  # noqa: F401
+
+    return find_cjk_font()
+
+
+if __name__ == "__main__":
+    print(build_font_cache() or "未找到中文字体")
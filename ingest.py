@@ -0,0 +1,159 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# ================= Excel 列式导入 =================
+# 采集器导出的宽表：第 3 行是表头，第 1 列是时间，其余每列一个通道 (如 "1号温度 温度(℃)")。
+# 表头只做一次正则匹配，数据按块读取后整体 melt 成长表，不再逐单元格构造字典。
+
+REGEX_PATTERN = re.compile(r"^([a-zA-Z0-9]+)(?:号)?([\u4e00-\u9fa5]+)\s+([\u4e00-\u9fa5]+)(?:[\(（](.+)[\)）])?(?:\.\d+)?$")
+
+HEADER_ROW = 2          # 与原 pd.read_excel(header=2) 一致
+CHUNK_ROWS = 20000      # 每次 melt 的宽表行数，决定峰值内存
+LONG_COLUMNS = ['timestamp', 'sensor_id', 'variable_type', 'unit', 'value']
+KEY_COLUMNS = ['timestamp', 'sensor_id', 'variable_type']
+
+
+def match_columns(headers):
+    """表头匹配：返回 [(列位置, sensor_id, variable_type, unit)]，第 1 列 (时间) 不参与"""
+    matched = []
+    for pos, col_name in enumerate(headers):
+        if pos == 0 or col_name is None: continue
+        col_str = str(col_name).strip()
+        if col_str.startswith("原始数据") or "Unnamed" in col_str: continue
+        match = REGEX_PATTERN.search(col_str)
+        if match:
+            raw_id, var_type, unit = match.group(1), match.group(2), match.group(4) if match.group(4) else ""
+            matched.append((pos, f"{raw_id}号", var_type, unit))
+    return matched
+
+
+def _categorical(labels, codes):
+    cats, inverse = np.unique(np.asarray(labels, dtype=object), return_inverse=True)
+    return pd.Categorical.from_codes(inverse[codes], categories=cats)
+
+
+def melt_chunk(rows, matched):
+    """宽表块 (二维对象数组) -> 长表；时间无效的行丢弃，数值无效的记为 NaN (上传为 null)"""
+    rows = np.asarray(rows, dtype=object)
+    if rows.ndim != 2 or len(rows) == 0 or not matched:
+        return pd.DataFrame(columns=LONG_COLUMNS)
+    ts = pd.to_datetime(pd.Series(rows[:, 0]), errors='coerce')
+    valid = ts.notna().to_numpy()
+    ts = ts.to_numpy()[valid]
+    positions = [pos for pos, *_ in matched]
+    block = pd.DataFrame(rows[valid][:, positions]).apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    n_rows, n_cols = block.shape
+    # 按列展开 (与原先逐列追加的顺序一致)
+    codes = np.repeat(np.arange(n_cols), n_rows)
+    return pd.DataFrame({
+        'timestamp': np.tile(ts, n_cols),
+        'sensor_id': _categorical([m[1] for m in matched], codes),
+        'variable_type': _categorical([m[2] for m in matched], codes),
+        'unit': _categorical([m[3] for m in matched], codes),
+        'value': block.T.ravel(),
+    })
+
+
+# ---------- 读取：按工作表、按块 ----------
+def _iter_xlsx(source, chunk_rows):
+    from openpyxl import load_workbook
+    # 只读模式逐行流式解析，不会把整个工作簿载入内存
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = None
+            for _ in range(HEADER_ROW + 1):
+                header = next(rows, None)
+            if header is None: continue
+            buf = []
+            for row in rows:
+                buf.append(row)
+                if len(buf) >= chunk_rows:
+                    yield ws.title, header, buf
+                    buf = []
+            if buf:
+                yield ws.title, header, buf
+    finally:
+        wb.close()
+
+
+def _iter_xls(source, chunk_rows):
+    # 老格式 (xlrd) 不支持流式读取，逐个工作表整体读入后再分块
+    for name, df in pd.read_excel(source, sheet_name=None, header=HEADER_ROW).items():
+        header = list(df.columns)
+        values = df.to_numpy(dtype=object)
+        for i in range(0, len(values), chunk_rows):
+            yield name, header, values[i:i + chunk_rows]
+
+
+def iter_excel_batches(source, chunk_rows=CHUNK_ROWS):
+    """逐工作表、逐块产出长表批次 (DataFrame)，峰值内存只与 chunk_rows 有关"""
+    name = getattr(source, "name", source if isinstance(source, str) else "")
+    reader = _iter_xls if str(name).lower().endswith(".xls") else _iter_xlsx
+    matched_by_sheet = {}
+    for sheet, header, rows in reader(source, chunk_rows):
+        if sheet not in matched_by_sheet:
+            matched_by_sheet[sheet] = match_columns(header)
+        batch = melt_chunk(rows, matched_by_sheet[sheet])
+        if not batch.empty:
+            yield batch
+
+
+def _concat_batches(batches):
+    # 各批次的分类列类别不同，直接 concat 会退化成 object 列；这里先合并类别再拼接，拼接后释放批次
+    cols = {
+        'timestamp': np.concatenate([b['timestamp'].to_numpy() for b in batches]),
+        **{col: union_categoricals([b[col] for b in batches]) for col in ('sensor_id', 'variable_type', 'unit')},
+        'value': np.concatenate([b['value'].to_numpy() for b in batches]),
+    }
+    batches.clear()
+    return pd.DataFrame(cols)
+
+
+def parse_excel_files(sources, chunk_rows=CHUNK_ROWS):
+    """解析一个或多个文件，合并成一张紧凑的长表；返回 (DataFrame 或 None, 提示信息)。
+    读取是分块的，但结果整张留在内存里 (确认上传前要预览，上传检查点也按行号记录)，
+    去重时峰值约为长表的两倍：每行约 20 字节 (时间、数值各 8 字节，三个分类列各 1~2 字节)。"""
+    batches, notes = [], []
+    for source in sources:
+        name = os.path.basename(str(getattr(source, "name", source)))
+        try:
+            parts = list(iter_excel_batches(source, chunk_rows))
+        except Exception as e:
+            notes.append(f"{name}: {e}")
+            continue
+        batches.extend(parts)
+        notes.append(f"{name}: {sum(len(b) for b in parts)} 条")
+    if not batches:
+        return None, "；".join(notes) or "没有可解析的数据"
+    df = _concat_batches(batches)
+    # 多个工作表 / 文件之间可能重复，按上传主键去重
+    df = df.drop_duplicates(subset=KEY_COLUMNS, ignore_index=True)
+    return df, f"解析完成 {len(df)} 条 ({'；'.join(notes)})"
+
+
+def format_timestamps(ts):
+    """批量把时间列格式化为 ISO 字符串 (与 Timestamp.isoformat 一致)"""
+    ts = pd.Series(ts)
+    if (ts.dt.microsecond != 0).any():
+        return ts.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").to_numpy(dtype=object)
+    return ts.dt.strftime("%Y-%m-%dT%H:%M:%S").to_numpy(dtype=object)
+
+
+def to_records(batch):
+    """把一个长表批次转成 upsert 需要的 JSON 记录 (只在发送前对当前批次做)"""
+    values = batch['value'].to_numpy(dtype=np.float64)
+    values = np.where(np.isnan(values), None, values.astype(object))
+    columns = {
+        'timestamp': format_timestamps(batch['timestamp']),
+        'sensor_id': batch['sensor_id'].astype(object).to_numpy(),
+        'variable_type': batch['variable_type'].astype(object).to_numpy(),
+        'unit': batch['unit'].astype(object).to_numpy(),
+        'value': values,
+    }
+    return [dict(zip(LONG_COLUMNS, row)) for row in zip(*(columns[c] for c in LONG_COLUMNS))]
@@ -0,0 +1,176 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# ================= 分阶段计时 =================
+# 拉取 → 清洗 → 降采样 → 绘图、解析 → 上传 各阶段用 span() 包起来，记录耗时、行数、字节数和内存。
+# 只有当前上下文里激活了 Recorder (侧栏诊断面板打开) 时才真正记录；
+# 否则 span() 返回同一个空对象，开销只是一次 ContextVar 读取。
+# 线程池里的任务要用 contextvars.copy_context().run 提交，才能记到发起请求的会话上。
+# 内存默认只记常驻内存 (RSS) 的增量，读一次 /proc，几乎没有开销；
+# 分配峰值要单独开启 (Recorder(trace_memory=True))：tracemalloc 是进程级的，开启期间所有会话都会变慢，
+# 多个会话或线程同时运行时峰值也只是近似值。
+
+_current = contextvars.ContextVar("sciplot_recorder", default=None)
+_mem_lock = threading.Lock()
+_open_spans = []        # 所有线程中尚未结束的 span，用来分摊 tracemalloc 的峰值
+_tracing_users = 0
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss():
+    # 当前进程的常驻内存 (字节)；没有 /proc 的平台返回 None
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+    def add(self, **fields):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def _mark_peak():
+    # 把截至目前的峰值记到每个未结束的 span 上，再重置峰值，嵌套的 span 互不干扰
+    peak = tracemalloc.get_traced_memory()[1]
+    for s in _open_spans:
+        if peak > s.peak:
+            s.peak = peak
+    tracemalloc.reset_peak()
+
+
+class _Span:
+    __slots__ = ("recorder", "record", "t0", "mem0", "peak", "rss0")
+
+    def __init__(self, recorder, name, fields):
+        self.recorder = recorder
+        self.record = {"name": name, "rows": None, "bytes": None, **fields}
+
+    def set(self, **fields):
+        self.record.update(fields)
+
+    def add(self, **fields):
+        for key, value in fields.items():
+            self.record[key] = (self.record.get(key) or 0) + value
+
+    def __enter__(self):
+        self.mem0 = self.rss0 = None
+        if self.recorder.trace_memory:
+            with _mem_lock:
+                if tracemalloc.is_tracing():
+                    _mark_peak()
+                    self.mem0 = self.peak = tracemalloc.get_traced_memory()[0]
+                    _open_spans.append(self)
+        else:
+            self.rss0 = _rss()
+        self.record["start"] = time.time()
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record["seconds"] = time.perf_counter() - self.t0
+        self.record["thread"] = threading.current_thread().name
+        if exc_type is not None:
+            self.record["error"] = exc_type.__name__
+        if self.mem0 is not None:
+            with _mem_lock:
+                if tracemalloc.is_tracing() and self in _open_spans:
+                    _mark_peak()
+                    _open_spans.remove(self)
+                    self.record["peak_bytes"] = max(0, self.peak - self.mem0)
+        elif self.rss0 is not None:
+            rss = _rss()
+            self.record["rss_bytes"] = None if rss is None else rss - self.rss0
+        self.recorder.append(self.record)
+        return False
+
+
+class Recorder:
+    """一个会话的记录器：保留最近 max_spans 条记录，可导出为 JSON lines。
+    trace_memory 为 True 时用 tracemalloc 记分配峰值 (进程级，开启期间整个进程变慢)，否则只记 RSS 增量"""
+
+    def __init__(self, session=None, max_spans=2000, trace_memory=False):
+        self.session = session
+        self.max_spans = max_spans
+        self.trace_memory = trace_memory
+        self.run_id = 0
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        record["run"] = self.run_id
+        if self.session is not None:
+            record["session"] = self.session
+        with self._lock:
+            self.spans.append(record)
+            if len(self.spans) > self.max_spans:
+                del self.spans[:len(self.spans) - self.max_spans]
+
+    def last_run(self):
+        with self._lock:
+            return [s for s in self.spans if s["run"] == self.run_id]
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def to_jsonl(self):
+        with self._lock:
+            return "".join(json.dumps(s, ensure_ascii=False, default=str) + "\n" for s in self.spans)
+
+
+def span(name, **fields):
+    """with span("fetch.page", rows=n) as s: ...；未激活记录器时什么都不做"""
+    recorder = _current.get()
+    if recorder is None:
+        return _NOOP
+    return _Span(recorder, name, fields)
+
+
+def enabled():
+    """当前是否在记录 (用于跳过只为诊断才需要的额外计算，如估算字节数)"""
+    return _current.get() is not None
+
+
+def activate(recorder):
+    """在当前上下文中启用记录器 (新的一轮运行)，返回 deactivate 需要的令牌"""
+    global _tracing_users
+    recorder.run_id += 1
+    traced = recorder.trace_memory
+    if traced:
+        with _mem_lock:
+            _tracing_users += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+    return _current.set(recorder), traced
+
+
+def deactivate(token):
+    global _tracing_users
+    var_token, traced = token
+    _current.reset(var_token)
+    if traced:
+        with _mem_lock:
+            _tracing_users -= 1
+            if _tracing_users <= 0 and tracemalloc.is_tracing():
+                _open_spans.clear()
+                tracemalloc.stop()
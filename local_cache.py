@@ -0,0 +1,275 @@
+import itertools
+import json
+import os
+import threading
+from datetime import timedelta
+
+import pandas as pd
+
+# ================= 本地列式缓存 =================
+# 目录结构:
+#   <root>/<name>/_manifest.json          每个分区已同步的区间 (lo, hi]
+#   <root>/<name>/2024-05-01.parquet      按天分区，分区内按 key_cols + 时间排序
+# 查询语义与原分页逻辑一致：左开右闭 (start, end]
+
+ONE_US = timedelta(microseconds=1)
+# 清单格式版本。早期版本的拉取有行数上限 (最多 50 页 / 20 万行)，被截断时仍把整个窗口记为已同步；
+# 读到旧版本 (没有版本号) 的清单时整体作废，已有分区在下次同步时重新拉取并按主键合并
+MANIFEST_VERSION = 2
+
+
+def days_between(start, end):
+    """[start, end] 涉及的日期 (YYYY-MM-DD)"""
+    return [d.strftime("%Y-%m-%d") for d in pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq='D')]
+
+
+def day_bounds(day):
+    """分区 day 覆盖 [00:00, 23:59:59.999999]，写成左开形式 (前一微秒, 当天最后一微秒]"""
+    d = pd.Timestamp(day)
+    return d - ONE_US, d + timedelta(days=1) - ONE_US
+
+
+def scope_key(key):
+    """清单中的 scope 名：None 表示整表，否则为序列主键拼接"""
+    return "*" if key is None else "|".join(map(str, key))
+
+
+def _merge(spans):
+    """合并重叠或首尾相接的 (lo, hi] 区间"""
+    merged = []
+    for a, b in sorted(spans):
+        if merged and a <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def _subtract(a, b, spans):
+    """(a, b] 减去已覆盖的区间，返回剩余的空洞"""
+    holes = []
+    for lo, hi in _merge(spans):
+        if hi <= a or lo >= b: continue
+        if lo > a: holes.append((a, lo))
+        a = max(a, hi)
+        if a >= b: break
+    if a < b: holes.append((a, b))
+    return holes
+
+
+class PartitionedCache:
+    """按天分区的 Parquet 缓存，每个分区记录高水位线，刷新时只拉取缺失的增量"""
+
+    def __init__(self, root, name, time_col='timestamp', key_cols=()):
+        self.dir = os.path.join(root, name)
+        self.time_col = time_col
+        self.key_cols = list(key_cols)
+        self._manifest_path = os.path.join(self.dir, "_manifest.json")
+        self._lock = threading.RLock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = set()       # 正在被某个线程同步的日期
+        self._epoch = 0             # 每次失效加一：拉取期间发生过失效，拉到的数据可能是回填前的，不落盘
+        self._listeners = []
+        os.makedirs(self.dir, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    def subscribe(self, fn):
+        """注册变更回调 fn(event, days, parts)，event 为 'commit' 或 'invalidate' (在持有缓存锁时调用)；
+        parts 为本次写入后各天分区的全部行 {day: DataFrame}，只含有新行写入的天，回调不必再读文件"""
+        self._listeners.append(fn)
+
+    def _notify(self, event, days, parts=None):
+        for fn in self._listeners:
+            fn(event, days, parts or {})
+
+    # ---------- 清单 (高水位线) ----------
+    # {day: {scope: [(lo, hi), ...]}}，scope 为 "*" (全部序列) 或某个序列的主键
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            if raw.get("version") != MANIFEST_VERSION:
+                return {}
+            return {day: {scope: [(pd.Timestamp(lo), pd.Timestamp(hi)) for lo, hi in spans] for scope, spans in scopes.items()}
+                    for day, scopes in raw["days"].items()}
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+    def _save_manifest(self):
+        raw = {day: {scope: [[lo.isoformat(), hi.isoformat()] for lo, hi in spans] for scope, spans in scopes.items()}
+               for day, scopes in sorted(self._manifest.items())}
+        tmp = self._manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "days": raw}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self._manifest_path)
+
+    def _part_path(self, day):
+        return os.path.join(self.dir, f"{day}.parquet")
+
+    def cached_days(self):
+        """清单里有同步记录的日期"""
+        with self._lock:
+            return sorted(self._manifest)
+
+    def complete_scopes(self, day):
+        """该天已完整缓存 (覆盖整天) 的 scope 列表；含 "*" 表示所有序列都完整"""
+        d_lo, d_hi = day_bounds(day)
+        with self._lock:
+            scopes = self._manifest.get(day, {})
+            return [scope for scope, spans in scopes.items() if not _subtract(d_lo, d_hi, spans)]
+
+    # ---------- 计算缺口 ----------
+    def _missing_in_day(self, day, a, b, key):
+        scopes = self._manifest.get(day, {})
+        spans = scopes.get("*", []) + (scopes.get(scope_key(key), []) if key is not None else [])
+        return _subtract(a, b, spans)
+
+    def missing_windows(self, start, end, series=None):
+        """返回 (start, end] 内尚未缓存的时间窗口列表，相邻窗口已合并。
+        series 为主键元组的集合时，只看这些序列 (整表缓存过的区间也算已覆盖)"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        keys = [None] if series is None else list(series)
+        windows = []
+        with self._lock:
+            for day in days_between(start, end):
+                d_lo, d_hi = day_bounds(day)
+                a, b = max(start, d_lo), min(end, d_hi)
+                if a >= b: continue
+                for key in keys:
+                    windows.extend(self._missing_in_day(day, a, b, key))
+        return _merge(windows)
+
+    # ---------- 增量同步 ----------
+    def sync(self, start, end, fetch, series=None, now=None):
+        """拉取 (start, end] 中的缺口并写入分区；fetch(lo, hi, filters) 返回已清洗的 DataFrame，
+        filters 为 {列名: 取值列表} (整表拉取时为 None)，由调用方下推成数据库的 in 过滤。
+        fetch 只读了窗口的一部分 (例如按目录跳过了没有数据的日子) 时返回 (DataFrame, 实际读取的区间列表)，
+        清单只登记这些区间，其余部分下次同步时再交给 fetch 决定。
+        返回新拉取的行数。某个窗口拉取失败时，之前成功的窗口已落盘，异常继续抛出。
+        访问数据库时不持有缓存锁，其他会话照常读取；同一天同时只有一个线程在同步，后来的等它做完再看还缺什么。"""
+        now = pd.Timestamp(now) if now is not None else pd.Timestamp.now()
+        fetched = 0
+        with self._lock:
+            if series is None:
+                scopes, filters = [None], None
+            else:
+                # 只为还缺数据的序列发请求；过滤条件是各列取值的笛卡尔积，覆盖记录也按积登记
+                pending = {key for key in series if self.missing_windows(start, end, [key])}
+                if not pending: return 0
+                series = pending
+                values = [sorted({key[i] for key in series}) for i in range(len(self.key_cols))]
+                filters = dict(zip(self.key_cols, values))
+                scopes = list(itertools.product(*values))
+            # 未来的数据还可能被写入，高水位线最多推进到当前时刻
+            windows = [(lo, min(hi, now)) for lo, hi in self.missing_windows(start, end, series) if lo < now]
+        for lo, hi in windows:
+            days = set(days_between(lo + ONE_US, hi))
+            with self._synced:
+                self._synced.wait_for(lambda: self._syncing.isdisjoint(days))
+                # 等待期间别的线程可能已经补上了一部分
+                todo = self.missing_windows(lo, hi, series)
+                self._syncing |= days
+                epoch = self._epoch
+            try:
+                for a, b in todo:
+                    result = fetch(a.to_pydatetime(), b.to_pydatetime(), filters)
+                    chunk, spans = result if isinstance(result, tuple) else (result, [(a, b)])
+                    spans = [(max(pd.Timestamp(x), a), min(pd.Timestamp(y), b)) for x, y in spans]
+                    fetched += len(chunk)
+                    with self._lock:
+                        if self._epoch != epoch:
+                            continue
+                        self._commit(chunk, _merge([(x, y) for x, y in spans if x < y]), scopes)
+            finally:
+                with self._synced:
+                    self._syncing -= days
+                    self._synced.notify_all()
+        return fetched
+
+    def _commit(self, chunk, spans, scopes):
+        days = sorted({day for lo, hi in spans for day in days_between(lo + ONE_US, hi)})
+        if not days:
+            return
+        if not chunk.empty:
+            chunk = chunk.copy()
+            chunk['_day'] = chunk[self.time_col].dt.strftime("%Y-%m-%d")
+            groups = dict(tuple(chunk.groupby('_day', sort=False)))
+        else:
+            groups = {}
+        parts = {}
+        for day in days:
+            part = groups.get(day)
+            if part is not None:
+                parts[day] = self._merge_partition(day, part.drop(columns='_day'))
+            d_lo, d_hi = day_bounds(day)
+            covered = [(max(lo, d_lo), min(hi, d_hi)) for lo, hi in spans if lo < d_hi and hi > d_lo]
+            day_scopes = self._manifest.setdefault(day, {})
+            for key in scopes:
+                scope = scope_key(key)
+                day_scopes[scope] = _merge(day_scopes.get(scope, []) + covered)
+        self._save_manifest()
+        self._notify('commit', days, parts)
+
+    def _merge_partition(self, day, rows):
+        path = self._part_path(day)
+        if os.path.exists(path):
+            rows = pd.concat([pd.read_parquet(path), rows], ignore_index=True)
+        # 同一主键以最新拉取的为准 (对应 upsert 的 on_conflict 键)
+        rows = rows.drop_duplicates(subset=[self.time_col] + self.key_cols, keep='last')
+        rows = rows.sort_values(self.key_cols + [self.time_col], kind='stable')
+        tmp = path + ".tmp"
+        rows.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        return rows
+
+    # ---------- 读取 ----------
+    def load(self, start, end, columns=None, series=None):
+        """从本地分区读取 (start, end] 的数据 (不访问数据库)；series 给定时只读这些序列"""
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        filters = None
+        if series is not None:
+            series = set(series)
+            if not series: return pd.DataFrame()
+            filters = [(col, 'in', sorted({key[i] for key in series})) for i, col in enumerate(self.key_cols)]
+        frames = []
+        with self._lock:
+            for day in days_between(start + ONE_US, end):
+                path = self._part_path(day)
+                if os.path.exists(path):
+                    frames.append(pd.read_parquet(path, columns=columns, filters=filters))
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True)
+        ts = df[self.time_col]
+        mask = (ts > start) & (ts <= end)
+        if series is not None and len(self.key_cols) > 1:
+            # 各列的 in 过滤是笛卡尔积，这里再精确筛一次
+            keys = pd.MultiIndex.from_frame(df[self.key_cols])
+            mask &= keys.isin(list(series))
+        return df[mask].reset_index(drop=True)
+
+    def known_series(self, start, end, extra_cols=()):
+        """本地缓存中 (start, end] 范围内出现过的序列 (主键列 + extra_cols)"""
+        cols = self.key_cols + list(extra_cols)
+        frames = []
+        with self._lock:
+            for day in days_between(pd.Timestamp(start) + ONE_US, end):
+                path = self._part_path(day)
+                if os.path.exists(path):
+                    frames.append(pd.read_parquet(path, columns=cols).drop_duplicates())
+        if not frames:
+            return pd.DataFrame(columns=cols)
+        return pd.concat(frames, ignore_index=True).drop_duplicates(subset=self.key_cols)
+
+    # ---------- 失效 ----------
+    def invalidate(self, start, end):
+        """回填旧数据后调用：删除与 [start, end] 相交的分区，下次读取时重新拉取"""
+        with self._lock:
+            self._epoch += 1
+            for day in days_between(start, end):
+                self._manifest.pop(day, None)
+                path = self._part_path(day)
+                if os.path.exists(path):
+                    os.remove(path)
+            self._save_manifest()
+            self._notify('invalidate', days_between(start, end))
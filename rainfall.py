@@ -0,0 +1,38 @@
+import pandas as pd
+
+# ================= 降雨叠加序列 =================
+# 降雨只作为每张图右轴的参考曲线，一次加载只算一遍：
+# 按时间跨度和每张图的像素列数选一个 "整" 的统计间隔 (5 分钟、1 小时、1 天……)，
+# 把原始记录或汇总数据累加成各间隔内的降雨总量，所有图共用这一条序列。
+
+# (名称, pandas 频率, 秒数)
+RAIN_INTERVALS = [
+    ("1分钟", "1min", 60),
+    ("5分钟", "5min", 300),
+    ("10分钟", "10min", 600),
+    ("30分钟", "30min", 1800),
+    ("1小时", "1h", 3600),
+    ("3小时", "3h", 10800),
+    ("6小时", "6h", 21600),
+    ("12小时", "12h", 43200),
+    ("1天", "1D", 86400),
+]
+
+
+def pick_interval(start, end, n_buckets, intervals=RAIN_INTERVALS):
+    """最细的、使间隔数不超过 n_buckets 的统计间隔；跨度太长时用最粗的一档"""
+    span = (pd.Timestamp(end) - pd.Timestamp(start)).total_seconds()
+    for interval in intervals:
+        if span / interval[2] <= n_buckets:
+            return interval
+    return intervals[-1]
+
+
+def interval_totals(df, start, end, n_buckets, time_col='timestamp'):
+    """降雨记录 (value 为每条记录或每个汇总桶的雨量) -> 各统计间隔的总量，返回 (DataFrame, 间隔名称)"""
+    name, freq, _ = pick_interval(start, end, n_buckets)
+    if df.empty:
+        return pd.DataFrame(columns=[time_col, 'value']), name
+    bucket = df[time_col].dt.floor(freq)
+    out = df.groupby(bucket, sort=True)['value'].sum(min_count=1).rename_axis(time_col).reset_index()
+    return out, name
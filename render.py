@@ -0,0 +1,195 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing as mp
+
+import numpy as np
+
+# ================= 离线程绘图 =================
+# 每张图先整理成只含数组和字符串的描述 (spec)，交给进程池用 Agg 后端渲染成 PNG / SVG 字节，
+# 多张图在多个核上同时画；结果按输入内容的哈希缓存，输入不变的重跑直接取图片。
+# 工作进程只导入本模块和 matplotlib，图用 Figure 对象直接创建，不进入 pyplot 的全局列表，画完即释放。
+#
+# spec 字段：
+#   title, ylabel, font (中文字体文件路径或 None), figsize, dpi, fmt ('png' / 'svg')
+#   lines: [(label, color, x, y, band_x, band_lo, band_hi)]，为空时不画左轴刻度；band_* 为 None 时不画极值带
+#   rain:  (x, y) 或 None；rain_label: 右轴标题和图例 (含统计间隔，如 "降雨量 (mm/1小时)")，缺省为 "降雨量 (mm)"
+
+RAIN_COLOR = '#3C5488'
+
+
+def render_panel(spec):
+    """在工作进程里把一张图画成图片字节"""
+    import io
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.ticker as ticker
+    from matplotlib.figure import Figure
+    from matplotlib.font_manager import FontProperties
+
+    fp = None
+    if spec.get("font") and os.path.exists(spec["font"]):
+        fp = FontProperties(fname=spec["font"])
+
+    fig = Figure(figsize=spec["figsize"], dpi=spec["dpi"])
+    ax1 = fig.subplots()
+
+    # 1. 左轴：传感器曲线 (科研配色 + 折线)
+    for label, color, x, y, band_x, band_lo, band_hi in spec["lines"]:
+        ax1.plot(x, y, label=label, color=color, linewidth=1.5, alpha=0.9)
+        # 汇总数据：用浅色带画出每个时间桶的极值范围，尖峰不会被均值抹平
+        if band_x is not None:
+            ax1.fill_between(band_x, band_lo, band_hi, color=color, alpha=0.15, linewidth=0)
+
+    # 2. 右轴：降雨 (纯折线，无 marker)
+    ax2 = ax1.twinx()
+    rain = spec.get("rain")
+    rain_label = spec.get("rain_label") or "降雨量 (mm)"
+    if rain is not None:
+        ax2.plot(rain[0], rain[1], color=RAIN_COLOR, linestyle='-', linewidth=1.5, alpha=0.8, label=rain_label)
+        # 保持 Y 轴从 0 开始
+        ax2.set_ylim(bottom=0)
+
+    # === 样式精修 ===
+    if spec["lines"]:
+        ax1.set_ylabel(spec["ylabel"], fontproperties=fp, fontsize=12)
+    else:
+        ax1.set_yticks([])
+
+    ax1.set_xlabel("时间 (Time)", fontproperties=fp, fontsize=12)
+    ax1.xaxis.set_major_locator(ticker.MaxNLocator(nbins=6))
+    ax1.set_title(spec["title"], fontproperties=fp, fontsize=14, fontweight='bold', pad=10)
+
+    ax1.tick_params(axis='both', direction='in', which='both', top=True, right=False, labeltop=False, labelright=False)
+    ax2.tick_params(axis='y', direction='in', right=True, labelright=False)
+
+    if rain is not None:
+        ax2.set_ylabel(rain_label, fontproperties=fp, fontsize=12)
+    else:
+        ax2.set_yticks([])
+
+    ax1.grid(True, linestyle=':', alpha=0.3)
+
+    if spec["lines"] or rain is not None:
+        lines1, labels1 = ax1.get_legend_handles_labels()
+        lines2, labels2 = ax2.get_legend_handles_labels()
+        leg = ax1.legend(lines1 + lines2, labels1 + labels2, loc='best', frameon=False)
+        if fp:
+            for text in leg.get_texts(): text.set_fontproperties(fp)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format=spec.get("fmt", "png"))
+    return buf.getvalue()
+
+
+def content_key(*parts):
+    """图片缓存键：对输入 (序列版本、绘图配置、清洗参数等) 的 repr 取摘要"""
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def array_version(*arrays):
+    """降雨等没有版本号的数组，按内容取摘要"""
+    h = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+class ImageCache:
+    """按字节数限制大小的 LRU 图片缓存，进程内所有会话共用"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._items[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes and len(self._items) > 1:
+                _, dropped = self._items.popitem(last=False)
+                self.nbytes -= len(dropped)
+
+
+class _Done:
+    """进程池不可用时在当前线程画好，接口与 Future 一致"""
+
+    def __init__(self, fn, *args):
+        self._result, self._error = None, None
+        try:
+            self._result = fn(*args)
+        except Exception as e:
+            self._error = e
+
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class Renderer:
+    def __init__(self, cache, max_workers=None):
+        self.cache = cache
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None and self.max_workers > 0:
+                # spawn：不从带着多个线程的服务进程 fork，工作进程只导入本模块
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=mp.get_context("spawn"))
+            return self._pool
+
+    def submit(self, key, spec):
+        """提交一张图，返回 Future (result() 为图片字节)；成功的结果写入缓存"""
+        pool = self._get_pool()
+        if pool is None:
+            future = _Done(render_panel, spec)
+        else:
+            try:
+                future = pool.submit(render_panel, spec)
+            except (BrokenProcessPool, RuntimeError):
+                self._drop_pool()
+                future = _Done(render_panel, spec)
+        return _Cached(self, future, key, spec)
+
+    def _drop_pool(self):
+        # 进程池已损坏 (例如工作进程被杀)，下次提交时重建
+        with self._lock:
+            self._pool = None
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+class _Cached:
+    def __init__(self, renderer, future, key, spec):
+        self._renderer, self._future, self._key, self._spec = renderer, future, key, spec
+
+    def result(self):
+        try:
+            data = self._future.result()
+        except BrokenProcessPool:
+            self._renderer._drop_pool()
+            data = render_panel(self._spec)
+        self._renderer.cache.put(self._key, data)
+        return data
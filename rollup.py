@@ -0,0 +1,244 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+from local_cache import ONE_US, day_bounds, days_between, scope_key
+
+# ================= 多分辨率汇总金字塔 =================
+# 每个级别对每个序列、每个时间桶存 min / max / sum / count，均值 = sum / count。
+# 汇总由本地缓存的原始分区按天生成，不需要改动服务端。
+# 缓存写入时只把这些天标记为待生成，真正用到某个级别时 (refresh) 才生成，读原始数据的加载不付这份代价；
+# 缓存失效时删掉这些天的汇总。
+#
+# (名称, pandas 频率, 桶宽秒数, 分区文件粒度)
+ROLLUP_LEVELS = [
+    ("1min", "1min", 60, "%Y-%m-%d"),
+    ("10min", "10min", 600, "%Y-%m-%d"),
+    ("1h", "1h", 3600, "%Y-%m"),
+    ("1d", "1D", 86400, "%Y"),
+]
+STATS = ['value_min', 'value_max', 'value_sum', 'count']
+
+
+def pick_level(start, end, n_buckets, levels=ROLLUP_LEVELS):
+    """查询规划：选桶数仍不少于 n_buckets 的最粗级别；最细级别都不够时返回 None (读原始数据)"""
+    span = (pd.Timestamp(end) - pd.Timestamp(start)).total_seconds()
+    for name, _, seconds, _ in reversed(levels):
+        if span / seconds >= n_buckets:
+            return name
+    return None
+
+
+def aggregate(df, freq, key_cols, time_col='timestamp', dim_cols=()):
+    """原始行 (含 value 列) 或更细一级的汇总行 (含 STATS 列) 聚合到 freq 粒度"""
+    group_cols = list(key_cols) + [time_col]
+    if df.empty:
+        return pd.DataFrame(columns=group_cols + list(dim_cols) + STATS)
+    df = df.assign(**{time_col: df[time_col].dt.floor(freq)})
+    g = df.groupby(group_cols, sort=False, observed=True)
+    if 'value_sum' in df.columns:
+        out = g.agg(value_min=('value_min', 'min'), value_max=('value_max', 'max'),
+                    value_sum=('value_sum', 'sum'), count=('count', 'sum'))
+    else:
+        out = g['value'].agg(value_min='min', value_max='max', value_sum='sum', count='count')
+    out = out.reset_index()
+    if dim_cols:
+        dims = df.drop_duplicates(subset=list(key_cols))[list(key_cols) + list(dim_cols)]
+        out = out.merge(dims, on=list(key_cols), how='left') if key_cols else out.assign(**dims.iloc[0].to_dict())
+    return out[group_cols + list(dim_cols) + STATS]
+
+
+class RollupStore:
+    """挂在 PartitionedCache 上的汇总金字塔，按天记录哪些序列已经生成汇总"""
+
+    def __init__(self, cache, value_stat='mean', dim_cols=(), levels=ROLLUP_LEVELS):
+        self.cache = cache
+        self.key_cols = cache.key_cols
+        self.time_col = cache.time_col
+        self.value_stat = value_stat
+        self.dim_cols = list(dim_cols)
+        self.levels = levels
+        self.dir = os.path.join(cache.dir, "_rollups")
+        self._built_path = os.path.join(self.dir, "_built.json")
+        self._lock = threading.RLock()
+        os.makedirs(self.dir, exist_ok=True)
+        try:
+            with open(self._built_path, "r", encoding="utf-8") as f:
+                self._built = {day: set(scopes) for day, scopes in json.load(f).items()}
+        except (OSError, ValueError):
+            self._built = {}
+        # 缓存清单作废 (例如格式升级) 后，那些天的汇总也不再可信，读取时按未生成处理
+        self._built = {day: scopes for day, scopes in self._built.items() if cache.complete_scopes(day)}
+        cache.subscribe(self._on_change)
+
+    def _save_built(self):
+        tmp = self._built_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({day: sorted(scopes) for day, scopes in sorted(self._built.items())}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self._built_path)
+
+    def _on_change(self, event, days, parts):
+        if event == 'invalidate':
+            self.drop_days(days)
+        else:
+            self.mark_stale(days)
+
+    # ---------- 覆盖情况 ----------
+    def unbuilt_days(self, start, end, series=None):
+        """(start, end] 中还没有汇总 (或汇总不含所需序列) 的日期"""
+        need = {"*"} if series is None else {scope_key(key) for key in series}
+        days = []
+        with self._lock:
+            for day in days_between(pd.Timestamp(start) + ONE_US, end):
+                built = self._built.get(day, set())
+                if "*" not in built and not need <= built:
+                    days.append(day)
+        return days
+
+    # ---------- 生成 / 删除 ----------
+    def build_days(self, days):
+        """用缓存中已完整的序列重新生成这些天的汇总 (未完整的天不生成，读取时现算)"""
+        with self._lock:
+            levels = {name: [] for name, *_ in self.levels}
+            built = {}
+            for day in days:
+                scopes = self.cache.complete_scopes(day)
+                if not scopes:
+                    continue
+                d_lo, d_hi = day_bounds(day)
+                raw = self.cache.load(d_lo, d_hi)
+                if "*" not in scopes and not raw.empty:
+                    keys = pd.MultiIndex.from_frame(raw[self.key_cols])
+                    raw = raw[keys.isin([tuple(scope.split("|")) for scope in scopes])]
+                # 逐级向上聚合：10min 由 1min 汇总而来，依此类推
+                source = raw
+                for name, freq, _, _ in self.levels:
+                    source = aggregate(source, freq, self.key_cols, self.time_col, self.dim_cols)
+                    levels[name].append(source)
+                built[day] = set(scopes)
+            stale = set(days)
+            for name, freq, _, part_fmt in self.levels:
+                frames = [f for f in levels[name] if not f.empty]
+                self._rewrite(name, part_fmt, stale, pd.concat(frames, ignore_index=True) if frames else None)
+            for day in days:
+                if day in built:
+                    self._built[day] = built[day]
+                else:
+                    self._built.pop(day, None)
+            self._save_built()
+
+    def mark_stale(self, days):
+        """这些天的原始数据变了：旧汇总留在文件里但不再使用，下次 refresh 时重新生成"""
+        with self._lock:
+            changed = [day for day in days if self._built.pop(day, None) is not None]
+            if changed:
+                self._save_built()
+
+    def drop_days(self, days):
+        with self._lock:
+            for name, _, _, part_fmt in self.levels:
+                self._rewrite(name, part_fmt, set(days), None)
+            for day in days:
+                self._built.pop(day, None)
+            self._save_built()
+
+    def _level_dir(self, name):
+        path = os.path.join(self.dir, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _rewrite(self, name, part_fmt, days, rows):
+        """替换分区文件中属于 days 的行"""
+        parts = {pd.Timestamp(day).strftime(part_fmt) for day in days}
+        new_groups = {}
+        if rows is not None:
+            new_groups = dict(tuple(rows.groupby(rows[self.time_col].dt.strftime(part_fmt), sort=False)))
+        for part in parts:
+            path = os.path.join(self._level_dir(name), f"{part}.parquet")
+            frames = []
+            if os.path.exists(path):
+                old = pd.read_parquet(path)
+                frames.append(old[~old[self.time_col].dt.strftime("%Y-%m-%d").isin(days)])
+            if part in new_groups:
+                frames.append(new_groups[part])
+            frames = [f for f in frames if not f.empty]
+            if not frames:
+                if os.path.exists(path): os.remove(path)
+                continue
+            out = pd.concat(frames, ignore_index=True).sort_values(self.key_cols + [self.time_col], kind='stable')
+            tmp = path + ".tmp"
+            out.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+
+    # ---------- 读取 ----------
+    def _finish(self, df, freq, start, end):
+        ts = df[self.time_col]
+        df = df[(ts >= pd.Timestamp(start).floor(freq)) & (ts <= pd.Timestamp(end))]
+        value = df['value_sum'] / df['count'] if self.value_stat == 'mean' else df['value_sum']
+        return df.assign(value=value).reset_index(drop=True)
+
+    def load(self, level, start, end, series=None):
+        """读取某一级别的汇总；value 列为均值 (传感器) 或累计值 (降雨)"""
+        name, freq, _, part_fmt = next(lv for lv in self.levels if lv[0] == level)
+        parts = sorted({d.strftime(part_fmt) for d in pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq='D')})
+        filters = None
+        if series is not None:
+            series = set(series)
+            filters = [(col, 'in', sorted({key[i] for key in series})) for i, col in enumerate(self.key_cols)]
+        frames = []
+        with self._lock:
+            for part in parts:
+                path = os.path.join(self._level_dir(name), f"{part}.parquet")
+                if os.path.exists(path):
+                    frames.append(pd.read_parquet(path, filters=filters))
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return pd.DataFrame(columns=self.key_cols + [self.time_col] + self.dim_cols + STATS + ['value'])
+        df = pd.concat(frames, ignore_index=True)
+        if series is not None and len(self.key_cols) > 1:
+            df = df[pd.MultiIndex.from_frame(df[self.key_cols]).isin(list(series))]
+        return self._finish(df, freq, start, end)
+
+    def aggregate_raw(self, raw, level, start, end):
+        """未生成汇总的天 (例如今天) 直接用原始行现算到同一级别"""
+        freq = next(lv[1] for lv in self.levels if lv[0] == level)
+        return self._finish(aggregate(raw, freq, self.key_cols, self.time_col, self.dim_cols), freq, start, end)
+
+    # ---------- 对外入口 ----------
+    def refresh(self, start, end, series, sync):
+        """让 (start, end] 的汇总就绪：缺汇总的天按整天调用 sync(lo, hi) 补齐原始数据，再生成这些天的汇总"""
+        for lo, hi in _day_runs(self.unbuilt_days(start, end, series)):
+            sync(lo, hi)
+        pending = self.unbuilt_days(start, end, series)
+        if pending:
+            self.build_days(pending)
+
+    def query(self, level, start, end, series, load_raw):
+        """读取汇总；仍未完整的天 (例如今天) 用 load_raw(lo, hi) 取原始行现算"""
+        df = self.load(level, start, end, series)
+        pending = self.unbuilt_days(start, end, series)
+        if not pending:
+            return df
+        frames = [df[~df[self.time_col].dt.strftime("%Y-%m-%d").isin(pending)]] if not df.empty else []
+        for lo, hi in _day_runs(pending):
+            raw = load_raw(max(lo, pd.Timestamp(start)), min(hi, pd.Timestamp(end)))
+            if not raw.empty:
+                frames.append(self.aggregate_raw(raw, level, start, end))
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return df.iloc[0:0]
+        return pd.concat(frames, ignore_index=True).sort_values(self.key_cols + [self.time_col], kind='stable').reset_index(drop=True)
+
+
+def _day_runs(days):
+    """把日期列表合并成连续的整天区间 (lo, hi]"""
+    runs = []
+    for day in sorted(days):
+        lo, hi = day_bounds(day)
+        if runs and runs[-1][1] == lo:
+            runs[-1] = (runs[-1][0], hi)
+        else:
+            runs.append((lo, hi))
+    return runs
@@ -0,0 +1,84 @@
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# ================= 序列索引 =================
+# 每次加载后把长表按 (sensor_id, variable_type, timestamp) 排序一次，
+# 每条序列就是几段连续的 NumPy 数组切片：按键 O(1) 取到，按时间二分切片，不再逐图全表扫描。
+# 紧凑存储：时间为 int64 纳秒时间戳，数值为 float32，维度字符串只存在索引里 (不按行重复)。
+
+Series = namedtuple("Series", ["key", "t", "v", "vmin", "vmax", "unit"])
+KEY_COLS = ['sensor_id', 'variable_type']
+
+
+def to_ns(ts):
+    return pd.Timestamp(ts).value
+
+
+def slice_series(key, t, v, vmin, vmax, unit, start=None, end=None):
+    """按时间闭区间二分切片，返回的 Series.t 是 datetime64 视图"""
+    a, b = 0, len(t)
+    if start is not None:
+        a = int(np.searchsorted(t, to_ns(start), side='left'))
+    if end is not None:
+        b = int(np.searchsorted(t, to_ns(end), side='right'))
+    pick = lambda arr: None if arr is None else arr[a:b]
+    return Series(key, t[a:b].view('datetime64[ns]'), v[a:b], pick(vmin), pick(vmax), unit)
+
+
+class SeriesStore:
+    def __init__(self, df, time_col='timestamp'):
+        if df is None or df.empty:
+            df = pd.DataFrame(columns=KEY_COLS + [time_col, 'value', 'unit'])
+        df = df.sort_values(KEY_COLS + [time_col], kind='stable')
+        self.t = df[time_col].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        self.v = df['value'].to_numpy(dtype=np.float32)
+        # 汇总数据额外带每个时间桶的极值
+        self.vmin = df['value_min'].to_numpy(dtype=np.float32) if 'value_min' in df.columns else None
+        self.vmax = df['value_max'].to_numpy(dtype=np.float32) if 'value_max' in df.columns else None
+        self._index = {}
+        if len(df):
+            sids = df['sensor_id'].astype(object).to_numpy()
+            vtypes = df['variable_type'].astype(object).to_numpy()
+            units = df['unit'].astype(object).to_numpy() if 'unit' in df.columns else np.full(len(df), "", dtype=object)
+            starts = np.flatnonzero(np.r_[True, (sids[1:] != sids[:-1]) | (vtypes[1:] != vtypes[:-1])])
+            stops = np.r_[starts[1:], len(df)]
+            for a, b in zip(starts, stops):
+                unit = units[a] if pd.notna(units[a]) else ""
+                self._index[(sids[a], vtypes[a])] = (int(a), int(b), unit)
+        self._versions = {}
+
+    def __len__(self):
+        return len(self.v)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def span(self, key):
+        """序列在底层数组中的 [start, stop) 与单位"""
+        return self._index[key]
+
+    def get(self, key, start=None, end=None):
+        """取一条序列 (数组视图，不复制)；start / end 给定时按时间二分切片，闭区间"""
+        if key not in self._index:
+            return None
+        a, b, unit = self._index[key]
+        return slice_series(key, self.t[a:b], self.v[a:b],
+                            None if self.vmin is None else self.vmin[a:b],
+                            None if self.vmax is None else self.vmax[a:b], unit, start, end)
+
+    def version(self, key):
+        """序列内容的摘要，内容不变摘要就不变，可作为下游缓存的键"""
+        if key not in self._versions:
+            a, b, unit = self._index[key]
+            h = hashlib.blake2b(digest_size=16)
+            h.update(repr((key, unit)).encode("utf-8"))
+            h.update(self.t[a:b].tobytes())
+            h.update(self.v[a:b].tobytes())
+            self._versions[key] = h.hexdigest()
+        return self._versions[key]
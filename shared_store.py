@@ -0,0 +1,239 @@
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+from series_store import SeriesStore, slice_series, to_ns
+
+# ================= 进程级共享序列存储 =================
+# 所有会话共用一份只读数据：每条序列 (汇总级别, sensor_id, variable_type) 是一个不可变数据块，
+# 时间为 int64 纳秒、数值为 float32，维度字符串每块只存一次。
+# - 会话只持有句柄 (SeriesHandle)，取数据是对共享数组的切片视图，不复制
+# - 已有数据块覆盖所请求的时间段时直接复用；重叠区间的会话共享同一块内存
+# - 同一序列同时被多个会话请求时只有一个线程去拉取，其余等待结果 (single-flight)
+# - 数据块按句柄引用计数，总内存超出预算时按最近最少使用淘汰无人引用的块
+# - 覆盖到 "现在" 的数据块还会继续增长，只在 live_ttl 秒内复用
+# - 加载出错时不放入数据块；调用方退回本地已有数据时用 ttl 限定复用时间，恢复后重新拉取
+
+
+class Block:
+    __slots__ = ("key", "level", "lo", "hi", "t", "v", "vmin", "vmax", "unit",
+                 "nbytes", "version", "refs", "expires", "__weakref__")
+
+    def __init__(self, key, level, lo, hi, t, v, vmin, vmax, unit, expires=None):
+        self.key, self.level, self.lo, self.hi = key, level, lo, hi
+        self.t, self.v, self.vmin, self.vmax, self.unit = t, v, vmin, vmax, unit
+        for arr in (t, v, vmin, vmax):
+            if arr is not None:
+                arr.flags.writeable = False
+        self.nbytes = sum(arr.nbytes for arr in (t, v, vmin, vmax) if arr is not None)
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((key, level, unit)).encode("utf-8"))
+        h.update(t.tobytes())
+        h.update(v.tobytes())
+        self.version = h.hexdigest()
+        self.refs = 0
+        self.expires = expires
+
+    def covers(self, lo, hi, now):
+        return self.lo <= lo and hi <= self.hi and (self.expires is None or now < self.expires)
+
+
+class SharedSeriesStore:
+    def __init__(self, budget_bytes, live_ttl=60.0, clock=time.time):
+        self.budget_bytes = budget_bytes
+        self.live_ttl = live_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()       # id(block) -> block，越靠后越新
+        self._by_key = {}               # (level, key) -> [block]
+        self._inflight = {}             # (level, key) -> [(lo, hi, Future)]
+        self.nbytes = 0
+
+    # ---------- 对外入口 ----------
+    def acquire(self, level, start, end, keys, loader, ttl=None):
+        """取 [start, end] 内的这些序列，返回句柄。
+        loader(keys) -> 长表 DataFrame，只对缺失的序列调用；level 为汇总级别名称 (原始数据用 None)。
+        loader 出错时必须抛出而不是返回不完整的数据：出错的加载不会放进共享存储，异常原样抛给调用方。
+        ttl 给定时新建的数据块只在 ttl 秒内复用 (例如出错后只读到本地已有的部分)"""
+        lo, hi = to_ns(start), to_ns(end)
+        now = self._clock()
+        blocks, waits, mine = {}, [], []
+        with self._lock:
+            for key in keys:
+                block = self._find(level, key, lo, hi, now)
+                if block is not None:
+                    blocks[key] = self._take(block)
+                    continue
+                pending = next((f for a, b, f in self._inflight.get((level, key), []) if a <= lo and hi <= b), None)
+                if pending is not None:
+                    waits.append((key, pending))
+                else:
+                    mine.append(key)
+            if mine:
+                future = Future()
+                for key in mine:
+                    self._inflight.setdefault((level, key), []).append((lo, hi, future))
+        try:
+            if mine:
+                try:
+                    built = self._build(level, lo, hi, mine, loader(set(mine)), now, ttl)
+                except BaseException as e:
+                    with self._lock:
+                        self._finish_inflight(level, mine, future)
+                    future.set_exception(e)
+                    raise
+                with self._lock:
+                    for key, block in built.items():
+                        self._insert(block)
+                        blocks[key] = self._take(block)
+                    self._finish_inflight(level, mine, future)
+                    self._evict()
+                future.set_result(built)
+            for key, pending in waits:
+                block = pending.result()[key]
+                with self._lock:
+                    if id(block) not in self._lru:
+                        self._insert(block)
+                    blocks[key] = self._take(block)
+        except BaseException:
+            # 已经取到的块归还引用，否则它们永远不会被淘汰
+            self._release(list(blocks.values()))
+            raise
+        return SeriesHandle(self, blocks, lo, hi)
+
+    def invalidate(self, start, end):
+        """数据被改写后，与 [start, end] 重叠的数据块不再复用 (已发出的句柄仍可读旧数据)"""
+        lo, hi = to_ns(start), to_ns(end)
+        with self._lock:
+            for block in list(self._lru.values()):
+                if block.lo <= hi and lo <= block.hi:
+                    self._remove(block)
+
+    def stats(self):
+        with self._lock:
+            return {"blocks": len(self._lru), "bytes": self.nbytes, "budget": self.budget_bytes,
+                    "referenced": sum(1 for b in self._lru.values() if b.refs)}
+
+    # ---------- 内部 ----------
+    def _find(self, level, key, lo, hi, now):
+        # 新块优先：出错后临时放入的块之后又有完整的块时用完整的
+        for block in reversed(self._by_key.get((level, key), [])):
+            if block.covers(lo, hi, now):
+                return block
+        return None
+
+    def _build(self, level, lo, hi, keys, df, now, ttl=None):
+        index = SeriesStore(df)
+        if ttl is not None:
+            expires = now + ttl
+        else:
+            expires = now + self.live_ttl if hi >= to_ns(pd.Timestamp.now()) else None
+        built = {}
+        for key in keys:
+            if key in index:
+                a, b, unit = index.span(key)
+                # 每块复制一份独立内存，单独淘汰时能真正释放
+                pick = lambda arr: None if arr is None else arr[a:b].copy()
+                built[key] = Block(key, level, lo, hi, pick(index.t), pick(index.v),
+                                   pick(index.vmin), pick(index.vmax), unit, expires)
+            else:
+                # loader 成功返回时区间内没有数据也记下来，避免反复查询
+                empty = np.empty(0, dtype=np.float32)
+                built[key] = Block(key, level, lo, hi, np.empty(0, dtype=np.int64), empty,
+                                   None, None, "", expires)
+        return built
+
+    def _finish_inflight(self, level, keys, future):
+        for key in keys:
+            entries = [e for e in self._inflight.get((level, key), []) if e[2] is not future]
+            if entries:
+                self._inflight[(level, key)] = entries
+            else:
+                self._inflight.pop((level, key), None)
+
+    def _insert(self, block):
+        # 新块覆盖了旧块且旧块无人引用时，旧块直接丢弃
+        for old in list(self._by_key.get((block.level, block.key), [])):
+            if old.refs == 0 and block.lo <= old.lo and old.hi <= block.hi:
+                self._remove(old)
+        self._by_key.setdefault((block.level, block.key), []).append(block)
+        self._lru[id(block)] = block
+        self.nbytes += block.nbytes
+
+    def _remove(self, block):
+        if self._lru.pop(id(block), None) is None:
+            return
+        self.nbytes -= block.nbytes
+        same = self._by_key.get((block.level, block.key), [])
+        same[:] = [b for b in same if b is not block]
+        if not same:
+            self._by_key.pop((block.level, block.key), None)
+
+    def _take(self, block):
+        block.refs += 1
+        self._lru.move_to_end(id(block))
+        return block
+
+    def _release(self, blocks):
+        with self._lock:
+            for block in blocks:
+                block.refs -= 1
+            self._evict()
+
+    def _evict(self):
+        for block in list(self._lru.values()):
+            if self.nbytes <= self.budget_bytes:
+                break
+            if block.refs == 0:
+                self._remove(block)
+
+
+class SeriesHandle:
+    """会话持有的只读视图，接口与 SeriesStore 一致；句柄被回收时自动归还引用"""
+
+    def __init__(self, store, blocks, lo, hi):
+        self._store = store
+        self._blocks = dict(blocks)
+        self._held = list(self._blocks.values())
+        self.lo, self.hi = lo, hi
+        self._finalizer = weakref.finalize(self, store._release, self._held)
+
+    def absorb(self, other):
+        """并入另一个句柄的序列 (引用随之转移)，用于按需追加加载"""
+        other._finalizer.detach()
+        self._blocks.update(other._blocks)
+        self._held.extend(other._held)
+        other._blocks, other._held = {}, []
+        return self
+
+    def release(self):
+        self._finalizer()
+
+    def __len__(self):
+        return sum(len(self.get(key).v) for key in self._blocks)
+
+    def __contains__(self, key):
+        return key in self._blocks
+
+    def keys(self):
+        return self._blocks.keys()
+
+    def get(self, key, start=None, end=None):
+        block = self._blocks.get(key)
+        if block is None:
+            return None
+        lo = self.lo if start is None else max(self.lo, to_ns(start))
+        hi = self.hi if end is None else min(self.hi, to_ns(end))
+        return slice_series(key, block.t, block.v, block.vmin, block.vmax, block.unit, lo, hi)
+
+    def version(self, key):
+        block = self._blocks[key]
+        if block.lo == self.lo and block.hi == self.hi:
+            return block.version
+        return f"{block.version}:{self.lo}:{self.hi}"
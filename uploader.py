@@ -0,0 +1,194 @@
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from instrument import enabled as tracing, span as trace_span
+
+# ================= 并发可续传上传 =================
+# - 批大小按实测吞吐和单批 JSON 体积自适应 (目标：每批约 target_seconds 秒、不超过 max_batch_bytes)
+# - 固定数量的 upsert 线程并发发送
+# - 临时性失败按指数退避重试，数据 / 约束错误直接判定失败
+# - 每个已确认的批次都记进检查点文件，中断后重新上传同一份数据会跳过已写入的行
+# client 只需要实现 client.table(name).upsert(records, ...).execute()，便于用本地替身测试
+
+
+def is_transient(exc):
+    # PostgREST 的 APIError 带 SQLSTATE / PGRST 错误码：22xxx 数据错误、23xxx 约束错误、PGRST1xx 请求错误不重试
+    code = str(getattr(exc, "code", "") or "")
+    if code[:2] in ("22", "23", "42") or code.startswith("PGRST1"):
+        return False
+    return not isinstance(exc, (TypeError, ValueError, KeyError))
+
+
+def data_fingerprint(data):
+    """同一份数据 (行序一致) 得到同一个上传 ID，用来找回检查点"""
+    h = hashlib.sha1(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+class Checkpoint:
+    """已确认写入的行区间 [start, stop)，每次确认后原子落盘"""
+
+    def __init__(self, path, total_rows):
+        self.path = path
+        self.total_rows = total_rows
+        self.done = []
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    saved = json.load(f)
+                if saved.get("rows") == total_rows:
+                    self.done = [tuple(span) for span in saved.get("done", [])]
+            except (OSError, ValueError):
+                pass
+
+    @property
+    def rows_done(self):
+        return sum(b - a for a, b in self.done)
+
+    def remaining(self):
+        """尚未确认的行区间"""
+        holes, cursor = [], 0
+        for a, b in self.done:
+            if a > cursor: holes.append((cursor, a))
+            cursor = max(cursor, b)
+        if cursor < self.total_rows: holes.append((cursor, self.total_rows))
+        return holes
+
+    def ack(self, start, stop):
+        merged = []
+        for a, b in sorted(self.done + [(start, stop)]):
+            if merged and a <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+            else:
+                merged.append((a, b))
+        self.done = merged
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.total_rows, "done": self.done}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AdaptiveBatcher:
+    """按确认结果调整批大小：向目标耗时靠拢，受单批体积上限约束，出现重试就减半"""
+
+    def __init__(self, initial=500, min_size=50, max_size=10000, target_seconds=1.0, max_batch_bytes=2_000_000):
+        self.size = initial
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.max_batch_bytes = max_batch_bytes
+        self.bytes_per_row = None
+        self._lock = threading.Lock()
+
+    def _cap(self):
+        cap = self.max_size
+        if self.bytes_per_row:
+            cap = min(cap, int(self.max_batch_bytes / self.bytes_per_row))
+        return max(self.min_size, cap)
+
+    def observe(self, rows, seconds, payload_bytes, attempts):
+        with self._lock:
+            if payload_bytes and rows:
+                self.bytes_per_row = payload_bytes / rows
+            if attempts > 1:
+                self.size = max(self.min_size, self.size // 2)
+            elif seconds > 0:
+                ideal = rows / seconds * self.target_seconds
+                self.size = int(0.5 * self.size + 0.5 * ideal)
+            self.size = max(self.min_size, min(self.size, self._cap()))
+
+    def next_size(self):
+        with self._lock:
+            return self.size
+
+
+class UploadPipeline:
+    def __init__(self, client, table, to_records, on_conflict, checkpoint_dir,
+                 max_workers=4, max_retries=5, backoff=0.5, batcher=None, sleep=time.sleep):
+        self.client = client
+        self.table = table
+        self.to_records = to_records
+        self.on_conflict = on_conflict
+        self.checkpoint_dir = checkpoint_dir
+        self.max_workers = max(1, int(max_workers))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batcher = batcher or AdaptiveBatcher()
+        self._sleep = sleep
+
+    def _send(self, data, start, stop):
+        """在工作线程里发送一批，返回 (start, stop, 耗时, 体积, 尝试次数)"""
+        with trace_span("upload.encode", rows=stop - start):
+            records = self.to_records(data.iloc[start:stop])
+            payload_bytes = len(json.dumps(records, ensure_ascii=False, default=str)) \
+                if self.batcher.bytes_per_row is None or tracing() else 0
+        for attempt in range(1, self.max_retries + 1):
+            t0 = time.perf_counter()
+            try:
+                with trace_span("upload.batch", rows=stop - start, bytes=payload_bytes or None, attempt=attempt):
+                    self.client.table(self.table).upsert(records, on_conflict=self.on_conflict, ignore_duplicates=True).execute()
+                return start, stop, time.perf_counter() - t0, payload_bytes, attempt
+            except Exception as e:
+                if not is_transient(e) or attempt == self.max_retries:
+                    raise
+                # 指数退避 + 抖动，避免所有线程同时重试
+                self._sleep(self.backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+
+    def run(self, data, progress=None):
+        """上传 data (长表)；progress(已确认行数, 总行数, 行/秒) 在调用线程回调。返回 (成功?, 信息)"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        ckpt = Checkpoint(os.path.join(self.checkpoint_dir, f"{self.table}-{data_fingerprint(data)}.json"), len(data))
+        resumed = ckpt.rows_done
+        holes = ckpt.remaining()
+        t0 = time.perf_counter()
+        error = None
+
+        def next_range():
+            # 从剩余区间里按当前批大小切下一段
+            if not holes: return None
+            a, b = holes[0]
+            stop = min(b, a + self.batcher.next_size())
+            if stop >= b: holes.pop(0)
+            else: holes[0] = (stop, b)
+            return a, stop
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            in_flight = set()
+            while True:
+                while error is None and len(in_flight) < self.max_workers:
+                    span = next_range()
+                    if span is None: break
+                    in_flight.add(pool.submit(contextvars.copy_context().run, self._send, data, *span))
+                if not in_flight:
+                    break
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    try:
+                        start, stop, seconds, payload_bytes, attempts = future.result()
+                    except Exception as e:
+                        # 出错后不再派发新批次，等在途的批次结束；已确认的部分留在检查点里
+                        error = error or e
+                        continue
+                    ckpt.ack(start, stop)
+                    self.batcher.observe(stop - start, seconds, payload_bytes, attempts)
+                    if progress:
+                        elapsed = time.perf_counter() - t0
+                        progress(ckpt.rows_done, len(data), (ckpt.rows_done - resumed) / elapsed if elapsed > 0 else 0.0)
+
+        if error is not None:
+            return False, f"已写入 {ckpt.rows_done}/{len(data)} 条后中断: {error} (重新上传同一文件将从断点继续)"
+        ckpt.clear()
+        note = f"，其中 {resumed} 条为断点续传跳过" if resumed else ""
+        return True, f"上传完成 {len(data)} 条{note}"
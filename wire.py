@@ -0,0 +1,105 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+# ================= 批量线路格式与快速解码 =================
+# 分页结果优先按 PostgREST CSV (Accept: text/csv) 请求，由 pyarrow 的多线程 CSV 读取器直接解码成列：
+# 时间列按 ISO 格式连同时区一次解析并统一换算到 UTC，数值列为 float64，文本列为字典编码 (转成 pandas 的 category)。
+# 整个过程不产生逐行的 Python 对象。客户端不支持 CSV 时退回 JSON，同样先转成列再解析。
+# 每一页都解码成 pyarrow.Table，分片拼接后只转换一次 DataFrame。
+
+UTC = pa.timestamp('us', tz='UTC')
+TEXT = pa.dictionary(pa.int32(), pa.string())
+
+
+def column_types(columns, time_col, numeric=()):
+    """列名 -> Arrow 类型：时间列为 UTC 时间戳，numeric 中的列为 float64，其余为字典编码的文本"""
+    return {col: UTC if col == time_col else pa.float64() if col in numeric else TEXT for col in columns}
+
+
+def parse_timestamps(values):
+    """ISO 时间字符串 (可带 'T'、小数秒、+00 / +08:00 之类的时区) -> UTC 时间戳数组，无法解析的为 null。
+    整列一次向量化转换；含不带时区的值时按 UTC 处理，格式不规整时才退回 pandas 逐个解析。"""
+    arr = values if isinstance(values, (pa.Array, pa.ChunkedArray)) else pa.array(values, from_pandas=True)
+    if pa.types.is_timestamp(arr.type):
+        return arr.cast(UTC) if arr.type.tz else pc.assume_timezone(arr, 'UTC').cast(UTC)
+    if not pa.types.is_string(arr.type) and not pa.types.is_large_string(arr.type):
+        arr = arr.cast(pa.string())
+    try:
+        return pc.cast(arr, UTC)
+    except pa.ArrowInvalid:
+        pass
+    try:
+        return pc.assume_timezone(pc.cast(arr, pa.timestamp('us')), 'UTC').cast(UTC)
+    except pa.ArrowInvalid:
+        parsed = pd.to_datetime(pd.Series(arr.to_pandas()), format='ISO8601', utc=True, errors='coerce')
+        return pa.array(parsed, type=UTC, from_pandas=True)
+
+
+def _coerce(table, types):
+    # 把各列转成目标类型：时间列走 parse_timestamps，数值列解析失败的记为 null
+    arrays = []
+    for name, typ in types.items():
+        col = table.column(name) if name in table.column_names else pa.nulls(table.num_rows, typ)
+        if col.type == typ:
+            pass
+        elif typ == UTC:
+            col = parse_timestamps(col)
+        elif typ == TEXT:
+            col = col.cast(pa.string()).dictionary_encode() if not pa.types.is_dictionary(col.type) else col.cast(TEXT)
+        else:
+            try:
+                col = col.cast(typ)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                col = pa.array(pd.to_numeric(col.to_pandas(), errors='coerce'), type=typ, from_pandas=True)
+        arrays.append(col)
+    return pa.table(arrays, names=list(types))
+
+
+def decode_csv(text, types):
+    """PostgREST 返回的 CSV 文本 (或字节) -> pyarrow.Table；表头以外没有行时返回空表"""
+    if not text:
+        return pa.table({name: pa.array([], typ) for name, typ in types.items()})
+    data = text.encode() if isinstance(text, str) else text
+    read = pacsv.ReadOptions(use_threads=True)
+    convert = pacsv.ConvertOptions(column_types=types, strings_can_be_null=True,
+                                   quoted_strings_can_be_null=False, include_columns=list(types))
+    try:
+        return pacsv.read_csv(io.BytesIO(data), read_options=read, convert_options=convert)
+    except pa.ArrowInvalid:
+        # 有无法按类型解析的值 (例如异常的时间字符串)：整表按文本读入再逐列转换
+        loose = pacsv.ConvertOptions(column_types={name: pa.string() for name in types},
+                                     strings_can_be_null=True, include_columns=list(types))
+        return _coerce(pacsv.read_csv(io.BytesIO(data), read_options=read, convert_options=loose), types)
+
+
+def decode_json(rows, types):
+    """PostgREST JSON 结果 (dict 列表) -> pyarrow.Table"""
+    if not rows:
+        return decode_csv(None, types)
+    columns = {name: pa.array([row.get(name) for row in rows], from_pandas=True) for name in types}
+    return _coerce(pa.table(columns), types)
+
+
+def tail_run(table, time_col):
+    """最后一行的时间 (ISO 字符串) 以及末尾与它同一时刻的行数，用于游标翻页"""
+    col = table.column(time_col)
+    last = col[-1]
+    same = pc.fill_null(pc.equal(col, last), False).to_numpy(zero_copy_only=False)[::-1]
+    run = len(same) if same.all() else int(same.argmin())
+    return last.as_py().isoformat(), run
+
+
+def to_frame(tables, types):
+    """各页的 Table 拼成一个 DataFrame：时间列为不带时区的 UTC datetime64[ns]，文本列为 category"""
+    tables = [t for t in tables if t.num_rows]
+    if not tables:
+        return pd.DataFrame()
+    table = pa.concat_tables(tables)
+    for i, (name, typ) in enumerate(types.items()):
+        if typ == UTC:
+            table = table.set_column(i, name, table.column(name).cast(pa.timestamp('ns')))
+    return table.to_pandas()